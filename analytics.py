@@ -0,0 +1,166 @@
+"""Sales reports from the rollup tables
+
+    python analytics.py backfill          # rebuild the rollups from all orders
+    python analytics.py report --days 30
+
+The rollups (migration 12) hold one row per day, per product and day and
+per category and day; checkout and cancellation keep them current, so a
+report reads O(days) rows and never scans orders. The backfill rebuilds
+them one day per short write transaction, so it can run on a live store.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta
+from database import get_db_connection, run_write_transaction, ORDER_CANCELLED
+from migrations import migrate
+
+REPORT_DAYS = 30
+MAX_REPORT_DAYS = 3660
+TOP_LIMIT = 10
+BACKFILL_PAUSE = 0.01
+
+ROLLUP_TABLES = ('sales_daily', 'sales_product_daily', 'sales_category_daily')
+
+
+def _rebuild_day(conn, day):
+    # Orders are stored with CURRENT_TIMESTAMP text, so a day is a text range
+    params = {'day': day, 'next': (date.fromisoformat(day) + timedelta(days=1)).isoformat(),
+              'cancelled': ORDER_CANCELLED}
+    for table in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE day = ?', (day,))
+    in_day = 'o.created_at >= :day AND o.created_at < :next AND o.status != :cancelled'
+    conn.execute(f'''
+        INSERT INTO sales_daily (day, orders, units, revenue, cancelled_orders)
+        SELECT :day, COUNT(DISTINCT o.id), COALESCE(SUM(oi.quantity), 0),
+               COALESCE(SUM(oi.quantity * oi.price), 0),
+               (SELECT COUNT(*) FROM orders WHERE created_at >= :day AND created_at < :next
+                                              AND status = :cancelled)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE {in_day}
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO sales_product_daily (day, product_id, orders, units, revenue)
+        SELECT :day, oi.product_id, COUNT(DISTINCT o.id), SUM(oi.quantity),
+               SUM(oi.quantity * oi.price)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE {in_day}
+        GROUP BY oi.product_id
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO sales_category_daily (day, category, orders, units, revenue)
+        SELECT :day, p.category, COUNT(DISTINCT o.id), SUM(oi.quantity),
+               SUM(oi.quantity * oi.price)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        JOIN products p ON p.id = oi.product_id
+        WHERE {in_day}
+        GROUP BY p.category
+    ''', params)
+    # A day whose orders were all deleted (see purge_users.py) drops out
+    conn.execute('''
+        DELETE FROM sales_daily WHERE day = ? AND orders = 0 AND cancelled_orders = 0
+    ''', (day,))
+
+
+def backfill(pause=BACKFILL_PAUSE, progress=None):
+    """Recompute every day's rollups from orders; returns stats"""
+    migrate()
+    conn = get_db_connection()
+    days = sorted({row[0] for row in conn.execute('''
+        SELECT DISTINCT date(created_at) FROM orders WHERE created_at IS NOT NULL
+        UNION SELECT day FROM sales_daily
+    ''')})
+    conn.close()
+    started = time.perf_counter()
+    for done, day in enumerate(days, start=1):
+        run_write_transaction(lambda conn: _rebuild_day(conn, day))
+        if progress:
+            progress(done, len(days))
+        time.sleep(pause)
+    return {'days': len(days), 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def get_sales_report(start, end, limit=TOP_LIMIT):
+    """Totals, per-day figures, top products and categories for [start, end]
+
+    `start` and `end` are ISO dates. Reads only the rollup tables.
+    """
+    conn = get_db_connection()
+    daily = [dict(row) for row in conn.execute('''
+        SELECT day, orders, units, ROUND(revenue, 2) AS revenue, cancelled_orders
+        FROM sales_daily WHERE day BETWEEN ? AND ? ORDER BY day
+    ''', (start, end))]
+    top_products = [dict(row) for row in conn.execute('''
+        SELECT s.product_id, p.name, SUM(s.orders) AS orders, SUM(s.units) AS units,
+               ROUND(SUM(s.revenue), 2) AS revenue
+        FROM sales_product_daily s LEFT JOIN products p ON p.id = s.product_id
+        WHERE s.day BETWEEN ? AND ?
+        GROUP BY s.product_id HAVING SUM(s.units) > 0
+        ORDER BY SUM(s.revenue) DESC LIMIT ?
+    ''', (start, end, limit))]
+    categories = [dict(row) for row in conn.execute('''
+        SELECT category, SUM(orders) AS orders, SUM(units) AS units,
+               ROUND(SUM(revenue), 2) AS revenue
+        FROM sales_category_daily WHERE day BETWEEN ? AND ?
+        GROUP BY category HAVING SUM(units) > 0
+        ORDER BY SUM(revenue) DESC
+    ''', (start, end))]
+    conn.close()
+    return {
+        'from': start,
+        'to': end,
+        'totals': {
+            'orders': sum(d['orders'] for d in daily),
+            'units': sum(d['units'] for d in daily),
+            'revenue': round(sum(d['revenue'] for d in daily), 2),
+            'cancelled_orders': sum(d['cancelled_orders'] for d in daily),
+        },
+        'daily': daily,
+        'top_products': top_products,
+        'categories': categories,
+    }
+
+
+def report_range(start=None, end=None, days=REPORT_DAYS):
+    """Validated (start, end) ISO dates; raises ValueError"""
+    # Order days are UTC (CURRENT_TIMESTAMP)
+    end = date.fromisoformat(end) if end else datetime.utcnow().date()
+    start = date.fromisoformat(start) if start else end - timedelta(days=days - 1)
+    if start > end:
+        raise ValueError('from must not be after to')
+    if (end - start).days >= MAX_REPORT_DAYS:
+        raise ValueError(f'at most {MAX_REPORT_DAYS} days')
+    return start.isoformat(), end.isoformat()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sales reports from the rollup tables')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backfill', help='rebuild the rollups from all orders')
+    report = commands.add_parser('report', help='print a report as JSON')
+    report.add_argument('--days', type=int, default=REPORT_DAYS)
+    report.add_argument('--from', dest='start')
+    report.add_argument('--to', dest='end')
+    report.add_argument('--limit', type=int, default=TOP_LIMIT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'backfill':
+        def progress(done, total):
+            print(f'\r{done}/{total} days', end='', file=sys.stderr, flush=True)
+        stats = backfill(progress=progress)
+        print(file=sys.stderr)
+        print(json.dumps(stats))
+        return 0
+    try:
+        start, end = report_range(args.start, args.end, args.days)
+    except ValueError as e:
+        parser.error(str(e))
+    migrate()
+    print(json.dumps(get_sales_report(start, end, args.limit), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,37 @@
 import os
 from flask import Flask
 from flask_login import LoginManager
-from werkzeug.security import check_password_hash
-from database import init_db, get_user_by_id
+from database import get_user_identity, close_db
+from migrations import ensure_schema
+import instrumentation
+import assets
+import suggest
+from images import product_image
+from passwords import verify_password
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
-# Initialize database
-init_db()
+# Check the schema version (migrates only if the database is behind;
+# seeding is a separate step: python seed_db.py)
+ensure_schema()
+
+# Hand each request's pooled connection back at teardown
+app.teardown_appcontext(close_db)
+
+# Per-request query/template timing, exposed on /metrics
+instrumentation.init_app(app)
+
+# Hashed, precompressed CSS/JS bundle (python assets.py), cached as immutable
+assets.init_app(app)
+
+# Prefix index behind /search/suggest; rebuilt in the background when the
+# catalog changes
+suggest.warm()
+
+# <picture> helper serving the resized WebP/AVIF product images
+app.jinja_env.globals['product_image'] = product_image
 
 # Login manager setup
 login_manager = LoginManager()
@@ -24,7 +46,8 @@ class User:
         self.id = str(user_data['id'])
         self.username = user_data['username']
         self.email = user_data['email']
-        self.password_hash = user_data['password_hash']
+        # Only present when loaded for a password check (see login)
+        self.password_hash = user_data['password_hash'] if 'password_hash' in user_data.keys() else None
         self.first_name = user_data['first_name']
         self.last_name = user_data['last_name']
         self.phone = user_data['phone']
@@ -43,11 +66,12 @@ class User:
         return self.id
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Runs in the hashing pool; may raise passwords.HashingOverloaded"""
+        return verify_password(self.password_hash, password)[0]
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = get_user_by_id(int(user_id))
+    user_data = get_user_identity(int(user_id))
     if user_data:
         return User(user_data)
     return None
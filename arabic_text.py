@@ -0,0 +1,56 @@
+import re
+import unicodedata
+
+# Harakat, tanween, shadda, sukun, superscript alef and Quranic marks
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TATWEEL = '\u0640'
+_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي',
+})
+_WORD = re.compile(r'\w+')
+
+
+def normalize_arabic(text):
+    """Fold Arabic spelling variants so they index and match the same
+
+    Removes diacritics and tatweel, unifies alef/hamza forms, taa marbuta
+    with haa and alef maqsura with yaa, strips the definite article and
+    lower-cases Latin text. Used both when indexing and when querying.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text)
+    text = _DIACRITICS.sub('', text).replace(_TATWEEL, '')
+    text = text.translate(_CHAR_MAP).lower()
+    return ' '.join(_strip_article(word) for word in _WORD.findall(text))
+
+
+_ARTICLES = ('وال', 'بال', 'كال', 'فال', 'ال')
+
+
+def _strip_article(word, min_rest=2):
+    for prefix in _ARTICLES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= min_rest:
+            return word[len(prefix):]
+    return word
+
+
+def normalize_prefix(text):
+    """normalize_arabic for text still being typed
+
+    The last word may be cut short, so its article is stripped however
+    little follows it ('الت' matches 'التلفاز', indexed as 'تلفاز').
+    """
+    words = normalize_arabic(text).split()
+    if words:
+        words[-1] = _strip_article(words[-1], min_rest=1)
+    return ' '.join(words)
+
+
+def tokenize(text):
+    """Normalized search tokens of `text`"""
+    return normalize_arabic(text).split()
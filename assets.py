@@ -0,0 +1,347 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import urllib.request
+from flask import current_app, request, send_from_directory
+
+# All optional: without them the build still works, just larger
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Third-party files served from static/vendor instead of their CDNs
+VENDOR = {
+    'bootstrap/bootstrap.rtl.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.rtl.min.css',
+    'bootstrap/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'fontawesome/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'fontawesome/webfonts/fa-solid-900.woff2':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/fa-solid-900.woff2',
+    'fontawesome/webfonts/fa-regular-400.woff2':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/fa-regular-400.woff2',
+    'fontawesome/webfonts/fa-brands-400.woff2':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/fa-brands-400.woff2',
+}
+CAIRO_CSS_URL = 'https://fonts.googleapis.com/css2?family=Cairo:wght@300;400;500;600;700&display=swap'
+# Google Fonts only serves woff2 to browsers it recognises
+FONTS_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+
+# Logical name -> sources, in order. Served as static/dist/<name>.<hash>.<ext>
+BUNDLES = {
+    'dist/app.css': ['vendor/bootstrap/bootstrap.rtl.min.css', 'vendor/fontawesome/css/all.min.css',
+                     'vendor/cairo/cairo.css', 'css/style.css'],
+    'dist/app.js': ['vendor/bootstrap/bootstrap.bundle.min.js', 'js/main.js'],
+}
+PRECOMPRESS = ('.css', '.js', '.svg', '.json')
+# Files whose names carry a content hash never change, so browsers may cache them forever
+IMMUTABLE_DIRS = ('dist/', 'derived/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_HASHED_NAME = re.compile(r'(?:^|[.-])[0-9a-f]{10,}[.-]')
+
+_ICON_CLASS = re.compile(r'\bfa-[a-z0-9-]+')
+_ICON_RULE = re.compile(r'((?:\.fa-[a-z0-9-]+:{1,2}before,?)+)\{content:"\\([0-9a-f]+)"\}')
+_FONT_FACE = re.compile(r'@font-face\s*\{[^}]*\}')
+_CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)')
+_SOURCE_MAP = re.compile(r'/[*/][#@] sourceMappingURL=[^\n]*')
+
+
+def _download(url, path, user_agent=None):
+    headers = {'User-Agent': user_agent} if user_agent else {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30) as response:
+        data = response.read()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def vendor(force=False):
+    """Download the CDN dependencies into static/vendor (once)"""
+    fetched = []
+    for name, url in VENDOR.items():
+        path = os.path.join(VENDOR_DIR, name)
+        if force or not os.path.exists(path):
+            _download(url, path)
+            fetched.append(name)
+
+    # Cairo: keep Google's per-script @font-face rules, pointing at local copies
+    cairo_css = os.path.join(VENDOR_DIR, 'cairo', 'cairo.css')
+    if force or not os.path.exists(cairo_css):
+        css = _download(CAIRO_CSS_URL, cairo_css, FONTS_USER_AGENT).decode('utf-8')
+        for url in sorted(set(_CSS_URL.findall(css))):
+            filename = url.rsplit('/', 1)[-1]
+            _download(url, os.path.join(VENDOR_DIR, 'cairo', filename))
+            css = css.replace(url, filename)
+        with open(cairo_css, 'w', encoding='utf-8') as f:
+            f.write(css)
+        fetched.append('cairo/cairo.css')
+    return fetched
+
+
+def used_icons():
+    """fa-* class names referenced by the templates and our own scripts"""
+    names = set()
+    sources = [TEMPLATES_DIR, os.path.join(STATIC_DIR, 'js')]
+    for directory in sources:
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith(('.html', '.js')):
+                    with open(os.path.join(root, filename), encoding='utf-8') as f:
+                        names.update(_ICON_CLASS.findall(f.read()))
+    return names
+
+
+def subset_icon_css(css, icons):
+    """Drop the Font Awesome glyph rules for icons nobody uses
+
+    Returns the trimmed CSS and the code points still referenced, which
+    the icon fonts are then subset to.
+    """
+    codepoints = set()
+
+    def keep(match):
+        names = [name for name in re.findall(r'\.(fa-[a-z0-9-]+)', match.group(1)) if name in icons]
+        if not names:
+            return ''
+        codepoints.add(int(match.group(2), 16))
+        return ','.join(f'.{name}::before' for name in names) + '{content:"\\%s"}' % match.group(2)
+
+    return _ICON_RULE.sub(keep, css), codepoints
+
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    # Without rjsmin only drop blank lines and indentation; gzip/brotli do the rest
+    return '\n'.join(line.strip() for line in js.splitlines() if line.strip())
+
+
+def _hashed_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+
+def _write(relative, data, written):
+    path = os.path.join(STATIC_DIR, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    written.add(relative)
+    if relative.endswith(PRECOMPRESS):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        written.add(relative + '.gz')
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+            written.add(relative + '.br')
+
+
+def _subset_font(path, codepoints):
+    if font_subset is None or not codepoints:
+        return None
+    try:
+        options = font_subset.Options()
+        options.flavor = 'woff2'
+        options.layout_features = ['*']
+        options.drop_tables += ['FFTM']
+        font = font_subset.load_font(path, options)
+        subsetter = font_subset.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        out = path + '.subset'
+        font_subset.save_font(font, out, options)
+        with open(out, 'rb') as f:
+            data = f.read()
+        os.remove(out)
+        return data
+    except Exception:  # woff2 output needs the brotli module
+        return None
+
+
+def _rewrite_fonts(css, source, codepoints, written):
+    """Copy fonts referenced by `source` into dist/fonts, hashed
+
+    Font Awesome's @font-face rules are cut down to their woff2 file
+    (subset to `codepoints`) and dropped if that file isn't vendored.
+    """
+    base = os.path.dirname(os.path.join(STATIC_DIR, source))
+    fonts = {}
+
+    def font_url(url):
+        if url in fonts:
+            return fonts[url]
+        path = os.path.normpath(os.path.join(base, url))
+        if not url.endswith('.woff2') or not os.path.exists(path):
+            fonts[url] = None
+            return None
+        data = _subset_font(path, codepoints) if codepoints is not None else None
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        relative = 'dist/fonts/' + _hashed_name(os.path.basename(path), data)
+        _write(relative, data, written)
+        fonts[url] = relative[len('dist/'):]
+        return fonts[url]
+
+    def face(match):
+        block = match.group(0)
+        urls = [u for u in _CSS_URL.findall(block) if u.endswith('.woff2')]
+        target = font_url(urls[0]) if urls else None
+        if target is None:
+            return ''
+        src = re.search(r'src\s*:[^;}]*', block).group(0)
+        return block.replace(src, f'src:url({target}) format("woff2")')
+
+    return _FONT_FACE.sub(face, css)
+
+
+def build():
+    """Vendor, subset, minify, hash and precompress the site's CSS/JS
+
+    Writes static/dist/ and its manifest.json, mapping the logical names
+    used in templates (e.g. 'dist/app.css') to the hashed files.
+    """
+    vendor()
+    icons = used_icons()
+    written = set()
+    manifest = {}
+    stats = {}
+
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(STATIC_DIR, source), encoding='utf-8') as f:
+                text = _SOURCE_MAP.sub('', f.read())
+            if bundle.endswith('.css'):
+                codepoints = None
+                if source.startswith('vendor/fontawesome/'):
+                    text, codepoints = subset_icon_css(text, icons)
+                parts.append(_rewrite_fonts(minify_css(text), source, codepoints, written))
+            else:
+                parts.append(text if '.min.' in source else minify_js(text))
+        data = (';\n' if bundle.endswith('.js') else '\n').join(parts).encode('utf-8')
+        relative = _hashed_name(bundle, data)
+        _write(relative, data, written)
+        manifest[bundle] = relative
+        stats[bundle] = len(data)
+
+    # Keep the previous build's files so pages rendered before a deploy still load
+    previous = {}
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            previous = json.load(f)
+    keep = written | set(previous.get('files', []))
+    for root, _, files in os.walk(DIST_DIR):
+        for filename in files:
+            relative = os.path.relpath(os.path.join(root, filename), STATIC_DIR).replace(os.sep, '/')
+            if relative != 'dist/manifest.json' and relative not in keep:
+                os.remove(os.path.join(root, filename))
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'assets': manifest, 'files': sorted(written)}, f, indent=1, sort_keys=True)
+    return manifest, stats, len(icons)
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f).get('assets', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_immutable(filename):
+    return (filename.startswith(IMMUTABLE_DIRS)
+            and _HASHED_NAME.search(os.path.basename(filename)) is not None)
+
+
+def serve_static(filename):
+    """Static view: precompressed variants and far-future caching for hashed files"""
+    if not _is_immutable(filename):
+        return current_app.send_static_file(filename)
+
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(
+                os.path.join(current_app.static_folder, filename + suffix)):
+            response = send_from_directory(current_app.static_folder, filename + suffix,
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = current_app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.expires = None
+    return response
+
+
+def init_app(app):
+    """Serve the built bundle (if any) through url_for('static', ...)"""
+    manifest = load_manifest()
+
+    @app.url_defaults
+    def hashed_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    app.view_functions['static'] = serve_static
+    # base.html falls back to the CDN links until `python assets.py` has run
+    app.jinja_env.globals['assets_built'] = all(name in manifest for name in BUNDLES)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'vendor':
+        fetched = vendor(force='--force' in sys.argv)
+        print(f"تم تنزيل {len(fetched)} ملف.")
+    elif command == 'build':
+        manifest, stats, icon_count = build()
+        for bundle, relative in manifest.items():
+            print(f'{relative}  {stats[bundle]} bytes')
+        print(f'{icon_count} icon classes kept; brotli: {"yes" if brotli else "no"}, '
+              f'font subsetting: {"yes" if font_subset else "no"}')
+    else:
+        print('usage: python assets.py [build|vendor [--force]]')
+        sys.exit(1)
@@ -0,0 +1,280 @@
+"""Online backups of the store database
+
+    python backup.py backup                   # one verified snapshot
+    python backup.py schedule --interval 3600 # every hour, forever
+    python backup.py list
+    python backup.py restore backups/store-20260101-120000-000000.db.gz --yes
+
+Snapshots are taken with SQLite's backup API a few pages at a time with a
+short sleep between steps, while holding one read snapshot of the source
+(WAL mode), so the copy is consistent, never restarts under concurrent
+writes and never blocks the site's writers. Each snapshot is checked with
+PRAGMA integrity_check before it is gzipped into BACKUP_DIR; only the
+newest BACKUP_KEEP are kept.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from database import DATABASE_PATH
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 128))
+BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.005))
+BACKUP_PROBE_INTERVAL = 0.05
+
+# Version counters the app caches against (see migrations.py); bumped past
+# their old values on restore so no worker or browser keeps a stale copy
+VERSION_TABLES = ('catalog_meta', 'user_state')
+
+
+class BackupError(Exception):
+    pass
+
+
+class _WriterProbe(threading.Thread):
+    """Measures how long a writer has to wait for the lock during a backup
+
+    Takes and immediately releases the write lock (nothing is written)
+    every BACKUP_PROBE_INTERVAL. The wait includes the app's own writes,
+    so it is an upper bound on the stall the backup caused.
+    """
+
+    def __init__(self, path, journal_mode):
+        super().__init__(daemon=True)
+        self.path = path
+        # Outside WAL, a commit needs every reader gone: EXCLUSIVE measures that
+        self.begin = 'BEGIN IMMEDIATE' if journal_mode == 'wal' else 'BEGIN EXCLUSIVE'
+        self.max_wait = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        while not self._done.wait(BACKUP_PROBE_INTERVAL):
+            started = time.perf_counter()
+            conn.execute(self.begin)
+            conn.execute('ROLLBACK')
+            self.max_wait = max(self.max_wait, time.perf_counter() - started)
+        conn.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise BackupError(f'integrity_check failed for {path}: {"; ".join(result[:5])}')
+
+
+def _gzip(source, target):
+    with open(source, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _gunzip(source, target):
+    with gzip.open(source, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _prefix(database):
+    return os.path.splitext(os.path.basename(database))[0]
+
+
+def list_snapshots(backup_dir=BACKUP_DIR, database=DATABASE_PATH):
+    """Snapshot paths for `database`, oldest first"""
+    return sorted(glob.glob(os.path.join(backup_dir, f'{_prefix(database)}-*.db.gz')))
+
+
+def rotate(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, database=DATABASE_PATH):
+    """Delete all but the newest `keep` snapshots; returns the deleted paths"""
+    snapshots = list_snapshots(backup_dir, database)
+    expired = snapshots[:-keep] if keep > 0 else []
+    for path in expired:
+        os.remove(path)
+    return expired
+
+
+def backup(database=DATABASE_PATH, backup_dir=BACKUP_DIR, pages=BACKUP_STEP_PAGES,
+           sleep=BACKUP_STEP_SLEEP, keep=BACKUP_KEEP, probe=True):
+    """Write one verified, gzipped snapshot of `database`; returns stats"""
+    os.makedirs(backup_dir, exist_ok=True)
+    # Microseconds keep overlapping runs (cron plus a manual one) apart;
+    # the work files are per process as well
+    name = f'{_prefix(database)}-{datetime.now():%Y%m%d-%H%M%S-%f}.db.gz'
+    target = os.path.join(backup_dir, name)
+    copy_path = os.path.join(backup_dir, f'.{name}.{os.getpid()}.db')
+    packed_path = f'{target}.{os.getpid()}.tmp'
+    steps = []
+
+    source = sqlite3.connect(database, timeout=30, isolation_level=None)
+    journal_mode = source.execute('PRAGMA journal_mode').fetchone()[0]
+    writer_probe = _WriterProbe(database, journal_mode) if probe else None
+    started = time.perf_counter()
+    last_step = [started]
+
+    def progress(status, remaining, total):
+        now = time.perf_counter()
+        steps.append(now - last_step[0])
+        time.sleep(sleep)
+        last_step[0] = time.perf_counter()
+
+    try:
+        # One read snapshot for the whole copy. In WAL mode readers don't
+        # block writers, and without it every concurrent commit would make
+        # the backup start over. In rollback-journal mode holding it would
+        # block all commits, so there each step takes its own lock instead.
+        if journal_mode == 'wal':
+            source.execute('BEGIN')
+            source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone()
+        if writer_probe:
+            writer_probe.start()
+        copy = sqlite3.connect(copy_path)
+        try:
+            source.backup(copy, pages=pages, progress=progress)
+        finally:
+            copy.close()
+            if writer_probe:
+                writer_probe.stop()
+            if source.in_transaction:
+                source.execute('ROLLBACK')
+        copied = time.perf_counter()
+
+        _integrity_check(copy_path)
+        size = os.path.getsize(copy_path)
+        _gzip(copy_path, packed_path)
+        if os.path.exists(target):
+            raise FileExistsError(f'{target} already exists')
+        os.replace(packed_path, target)
+    finally:
+        source.close()
+        for path in (copy_path, packed_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    seconds = time.perf_counter() - started
+    copy_seconds = copied - started
+    return {
+        'snapshot': target,
+        'bytes': size,
+        'compressed_bytes': os.path.getsize(target),
+        'steps': len(steps),
+        'seconds': round(seconds, 3),
+        'copy_seconds': round(copy_seconds, 3),
+        'mb_per_second': round(size / copy_seconds / 1e6, 2) if copy_seconds else None,
+        # Longest the source was locked by one step, and the longest a
+        # writer actually waited while the copy ran
+        'max_step_ms': round(max(steps, default=0) * 1000, 2),
+        'max_writer_wait_ms': round(writer_probe.max_wait * 1000, 2) if writer_probe else None,
+        'deleted': rotate(backup_dir, keep, database),
+    }
+
+
+def _version_offsets(conn):
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {table: conn.execute(f'SELECT COALESCE(MAX(version), 0) FROM {table}').fetchone()[0]
+            for table in VERSION_TABLES if table in tables}
+
+
+def restore(snapshot, database=DATABASE_PATH):
+    """Replace `database`'s contents with a snapshot (safe while the app runs)
+
+    The snapshot is unpacked and verified first, then copied in with the
+    backup API, which swaps the contents under the database's own locks.
+    """
+    work_path = os.path.join(os.path.dirname(os.path.abspath(database)),
+                             f'.restore-{os.getpid()}.db')
+    try:
+        _gunzip(snapshot, work_path)
+        _integrity_check(work_path)
+        source = sqlite3.connect(work_path)
+        target = sqlite3.connect(database, timeout=30)
+        try:
+            offsets = _version_offsets(target)
+            source.backup(target)
+            restored = _version_offsets(target)
+            for table, offset in offsets.items():
+                if table in restored:
+                    target.execute(f'UPDATE {table} SET version = version + ?', (offset + 1,))
+            target.commit()
+        finally:
+            source.close()
+            target.close()
+    finally:
+        if os.path.exists(work_path):
+            os.remove(work_path)
+    return {'restored': snapshot, 'database': database}
+
+
+def schedule(interval, **options):
+    """Take a backup every `interval` seconds until interrupted"""
+    while True:
+        started = time.monotonic()
+        try:
+            print(json.dumps(backup(**options)), flush=True)
+        except (BackupError, sqlite3.Error, OSError) as e:
+            print(json.dumps({'event': 'backup_failed', 'error': str(e)}), file=sys.stderr, flush=True)
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Online backups of the store database')
+    parser.add_argument('--database', default=DATABASE_PATH)
+    parser.add_argument('--dir', default=BACKUP_DIR, help='where snapshots are kept')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for command in ('backup', 'schedule'):
+        sub = commands.add_parser(command)
+        sub.add_argument('--keep', type=int, default=BACKUP_KEEP, help='snapshots to keep')
+        sub.add_argument('--pages', type=int, default=BACKUP_STEP_PAGES, help='pages per step')
+        sub.add_argument('--sleep', type=float, default=BACKUP_STEP_SLEEP,
+                         help='seconds to sleep between steps')
+        sub.add_argument('--no-probe', action='store_true', help="don't measure writer stalls")
+        if command == 'schedule':
+            sub.add_argument('--interval', type=float, default=3600, help='seconds between backups')
+
+    commands.add_parser('list')
+    load = commands.add_parser('restore')
+    load.add_argument('snapshot')
+    load.add_argument('--yes', action='store_true', help='really overwrite the database')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for path in list_snapshots(args.dir, args.database):
+            print(f'{path}  {os.path.getsize(path):,} bytes')
+        return 0
+    if args.command == 'restore':
+        if not args.yes:
+            print(f'سيتم استبدال {args.database} بالنسخة {args.snapshot}. أعد التشغيل مع --yes للتأكيد.',
+                  file=sys.stderr)
+            return 1
+        print(json.dumps(restore(args.snapshot, args.database)))
+        return 0
+
+    options = dict(database=args.database, backup_dir=args.dir, pages=args.pages,
+                   sleep=args.sleep, keep=args.keep, probe=not args.no_probe)
+    if args.command == 'schedule':
+        schedule(args.interval, **options)
+    try:
+        print(json.dumps(backup(**options)))
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
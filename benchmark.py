@@ -0,0 +1,473 @@
+"""Storefront benchmark: seeds a synthetic store and measures the routes
+
+    python benchmark.py --products 10000 --requests 200
+    python benchmark.py --mode gunicorn --workers 4 --concurrency 16
+    python benchmark.py --out new.json --baseline baseline.json --threshold 0.2
+    python benchmark.py --mode gunicorn --threads 4 --routes / /products /search \
+        --login-storm 32 --baseline quiet.json    # catalog p99 under a login flood
+
+Everything runs against a fresh store.db in a temp directory; the real
+database is never touched. Results are written as JSON, and when a
+baseline is given the run fails (exit code 1) if any route's p95 got
+slower, or its requests/sec dropped, by more than the threshold.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+BENCH_PASSWORD = 'bench-password'
+WORDS = ['ساعة', 'هاتف', 'كاميرا', 'لابتوب', 'سماعة', 'شاحن', 'كابل', 'حقيبة',
+         'قلم', 'مكتب', 'كرسي', 'مصباح', 'شاشة', 'طابعة', 'ماوس', 'لوحة']
+CATEGORIES = ['إلكترونيات', 'إكسسوارات', 'منزل', 'مكتب', 'ألعاب', 'رياضة']
+CHUNK = 10000
+
+# (name, method, needs login)
+ROUTES = [
+    ('/', 'GET', False),
+    ('/products', 'GET', False),
+    ('/search', 'GET', False),
+    ('/cart', 'GET', True),
+    ('/cart/add', 'POST', True),
+    ('/checkout', 'POST', True),
+    ('/profile', 'GET', True),
+    ('/wishlist/page', 'GET', True),
+]
+
+
+def _chunks(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(products, users, carts, orders, seed_value=42):
+    """Fill the (already migrated) temp database with synthetic data"""
+    from werkzeug.security import generate_password_hash
+    from database import get_db_connection, refresh_search_index
+
+    rnd = random.Random(seed_value)
+    conn = get_db_connection()
+    started = time.perf_counter()
+
+    def product_rows():
+        for i in range(products):
+            name = f'{rnd.choice(WORDS)} {rnd.choice(WORDS)} {i}'
+            yield (name, f'وصف {rnd.choice(WORDS)} {rnd.choice(WORDS)}',
+                   rnd.randint(10, 5000), rnd.choice(CATEGORIES), 'favicon.ico',
+                   1 if rnd.random() < 0.05 else 0, 1, 1_000_000)
+
+    for batch in _chunks(product_rows()):
+        conn.executemany('''
+            INSERT INTO products (name, description, price, category, image_url, featured, in_stock, stock_quantity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.commit()
+    refresh_search_index()
+
+    # Hashing is deliberately slow, so every bench user shares one hash
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    for batch in _chunks((f'bench{i}', f'bench{i}@example.com', password_hash)
+                         for i in range(users)):
+        conn.executemany('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)', batch)
+        conn.commit()
+
+    product_ids = [row[0] for row in conn.execute('SELECT id FROM products')]
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+
+    for batch in _chunks((rnd.choice(user_ids), rnd.choice(product_ids), rnd.randint(1, 3))
+                         for _ in range(carts)):
+        conn.executemany('''
+            INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, product_id) DO NOTHING
+        ''', batch)
+        conn.commit()
+    for batch in _chunks((rnd.choice(user_ids), rnd.choice(product_ids)) for _ in range(carts)):
+        conn.executemany('INSERT OR IGNORE INTO wishlist (user_id, product_id) VALUES (?, ?)', batch)
+        conn.commit()
+
+    next_order = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM orders').fetchone()[0]) + 1
+    for batch in _chunks(range(orders)):
+        order_rows, item_rows = [], []
+        for _ in batch:
+            order_id = next_order
+            next_order += 1
+            lines = [(rnd.choice(product_ids), rnd.randint(1, 3), rnd.randint(10, 5000))
+                     for _ in range(rnd.randint(1, 4))]
+            order_rows.append((order_id, rnd.choice(user_ids),
+                               sum(q * p for _, q, p in lines)))
+            item_rows.extend((order_id, pid, q, p) for pid, q, p in lines)
+        conn.executemany('INSERT INTO orders (id, user_id, total_price) VALUES (?, ?, ?)', order_rows)
+        conn.executemany('''
+            INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)
+        ''', item_rows)
+        conn.commit()
+
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return {'seconds': round(time.perf_counter() - started, 2),
+            'product_ids': product_ids, 'users': users}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class Workload:
+    """Picks the request (path, JSON body) for each route, reproducibly"""
+
+    def __init__(self, product_ids, seed_value=7):
+        self.product_ids = product_ids
+        self.rnd = random.Random(seed_value)
+        self.lock = threading.Lock()
+
+    def request(self, route):
+        with self.lock:
+            word = self.rnd.choice(WORDS)
+            category = self.rnd.choice(CATEGORIES)
+            product_id = self.rnd.choice(self.product_ids)
+            use_category = self.rnd.random() < 0.5
+        if route == '/products':
+            return '/products?' + urlencode({'category': category} if use_category else {}), None
+        if route == '/search':
+            return '/search?' + urlencode({'q': word}), None
+        if route == '/cart/add':
+            return route, {'product_id': product_id, 'quantity': 1}
+        return route, None
+
+    def refill(self):
+        """Cart line added (unmeasured) before each measured /checkout"""
+        with self.lock:
+            return {'product_id': self.rnd.choice(self.product_ids), 'quantity': 1}
+
+
+def run_test_client(workload, routes, requests_per_route):
+    """Drive the app in-process through Flask's test client"""
+    from app import app
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'bench0', 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit('bench login failed')
+
+    results = {}
+    for route, method, _ in routes:
+        # Warm-up request so imports and caches don't count against p99
+        path, body = workload.request(route)
+        client.open(path, method=method, json=body)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests_per_route):
+            path, body = workload.request(route)
+            if route == '/checkout':
+                client.post('/cart/add', json=workload.refill())
+            t0 = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                errors += 1
+        results[route] = summarize(latencies, time.perf_counter() - started, errors)
+    return results
+
+
+class HttpSession:
+    """Minimal keep-alive HTTP client that carries the session cookie"""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.cookie = None
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, quote(path, safe='/?=&%'), body=body, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, db_path, threads=1, env=None):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_PATH=db_path, **(env or {}))
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('gunicorn did not start')
+
+
+class LoginStorm:
+    """Threads posting wrong passwords to /login until stopped
+
+    The per-IP limit is lifted for the run (everything comes from
+    127.0.0.1), so the flood reaches the per-username throttle and the
+    password hashing pool, as one spread over many addresses would.
+    """
+    ENV = {'LOGIN_IP_BURST': '1000000', 'LOGIN_IP_PER_MINUTE': '1000000'}
+
+    def __init__(self, port, threads, users):
+        self.port = port
+        self.users = users
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.threads = [threading.Thread(target=self.loop, args=(i,), daemon=True)
+                        for i in range(threads)]
+
+    def loop(self, seed_value):
+        rnd = random.Random(seed_value)
+        session = HttpSession(self.port)
+        while not self.done.is_set():
+            form = {'username': f'bench{rnd.randrange(self.users)}', 'password': 'wrong'}
+            try:
+                status = session.request('POST', '/login', form=form)
+            except (OSError, http.client.HTTPException):
+                status = 599
+                session.conn.close()
+            with self.lock:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+        session.conn.close()
+
+    def start(self):
+        self.started = time.perf_counter()
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        self.done.set()
+        for t in self.threads:
+            t.join()
+        elapsed = time.perf_counter() - self.started
+        attempts = sum(self.statuses.values())
+        return {'threads': len(self.threads), 'attempts': attempts,
+                'attempts_per_second': round(attempts / elapsed, 1) if elapsed else 0.0,
+                'statuses': {str(k): v for k, v in sorted(self.statuses.items())}}
+
+
+def run_gunicorn(workload, routes, requests_per_route, workers, concurrency, db_path, users,
+                 threads=1, storm=0):
+    """Drive a real gunicorn server with `concurrency` client threads
+
+    With `storm` > 0, a LoginStorm runs for the whole measurement and its
+    stats are returned under the 'login_storm' key.
+    """
+    proc, port = start_gunicorn(workers, db_path, threads, LoginStorm.ENV if storm else None)
+    login_storm = None
+    sessions = []
+    try:
+        for i in range(concurrency):
+            session = HttpSession(port)
+            session.request('POST', '/login', form={'username': f'bench{i % users}',
+                                                    'password': BENCH_PASSWORD})
+            sessions.append(session)
+
+        if storm:
+            login_storm = LoginStorm(port, storm, users)
+            login_storm.start()
+        results = {}
+        for route, method, _ in routes:
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+            per_thread = max(1, requests_per_route // concurrency)
+
+            def client_loop(session):
+                local = []
+                for _ in range(per_thread):
+                    path, body = workload.request(route)
+                    if route == '/checkout':
+                        session.request('POST', '/cart/add', json_body=workload.refill())
+                    t0 = time.perf_counter()
+                    try:
+                        status = session.request(method, path, json_body=body)
+                    except (OSError, http.client.HTTPException):
+                        status = 599
+                        session.conn.close()
+                    local.append(time.perf_counter() - t0)
+                    if status >= 400:
+                        with lock:
+                            errors[0] += 1
+                with lock:
+                    latencies.extend(local)
+
+            threads = [threading.Thread(target=client_loop, args=(s,)) for s in sessions]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            results[route] = summarize(latencies, time.perf_counter() - started, errors[0])
+        if login_storm:
+            results['login_storm'] = login_storm.stop()
+            login_storm = None
+        return results
+    finally:
+        if login_storm:
+            login_storm.stop()
+        # Threaded workers wait for open keep-alive connections on shutdown
+        for session in sessions:
+            session.conn.close()
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def compare(results, baseline, threshold):
+    """List of regressions of `results` against a stored baseline run"""
+    failures = []
+    for route, base in baseline.get('results', {}).items():
+        now = results.get(route)
+        if not now:
+            continue
+        if base['p95_ms'] and now['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            failures.append(f"{route}: p95 {now['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if base['rps'] and now['rps'] < base['rps'] * (1 - threshold):
+            failures.append(f"{route}: {now['rps']} req/s < baseline {base['rps']} req/s")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--carts', type=int, default=5000, help='cart and wishlist rows')
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--routes', nargs='*', help='only these routes (default: all)')
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=16, help='gunicorn client threads')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker')
+    parser.add_argument('--login-storm', type=int, default=0, metavar='THREADS',
+                        help='flood /login with wrong passwords while measuring (gunicorn mode)')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='fail when slower than this results file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed regression against the baseline (0.2 = 20%%)')
+    parser.add_argument('--keep', action='store_true', help='keep the temp database')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='store-bench-')
+    db_path = os.path.join(workdir, 'store.db')
+    # database.py reads DATABASE_PATH at import time
+    os.environ['DATABASE_PATH'] = db_path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        from migrations import migrate
+        migrate()
+        seeded = seed(args.products, args.users, args.carts, args.orders)
+        print(f"seeded {args.products} products, {args.users} users, {args.carts} cart rows, "
+              f"{args.orders} orders in {seeded['seconds']}s")
+
+        routes = [r for r in ROUTES if not args.routes or r[0] in args.routes]
+        workload = Workload(seeded['product_ids'])
+        if args.mode == 'client':
+            results = run_test_client(workload, routes, args.requests)
+        else:
+            from database import get_pool
+            get_pool().close_all()
+            results = run_gunicorn(workload, routes, args.requests, args.workers,
+                                   args.concurrency, db_path, args.users,
+                                   args.threads, args.login_storm)
+        storm = results.pop('login_storm', None)
+
+        report = {
+            'meta': {
+                'mode': args.mode,
+                'products': args.products, 'users': args.users,
+                'carts': args.carts, 'orders': args.orders,
+                'requests_per_route': args.requests,
+                'workers': args.workers if args.mode == 'gunicorn' else None,
+                'concurrency': args.concurrency if args.mode == 'gunicorn' else 1,
+                'threads': args.threads if args.mode == 'gunicorn' else None,
+                'python': sys.version.split()[0],
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'results': results,
+        }
+        if storm:
+            report['login_storm'] = storm
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        print(f"{'route':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+        for route, r in results.items():
+            print(f"{route:<16}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['rps']:>10}{r['errors']:>8}")
+        if storm:
+            print(f"login storm: {storm['attempts']} attempts ({storm['attempts_per_second']}/s), "
+                  f"statuses {storm['statuses']}")
+        print(f'results written to {args.out}')
+
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                failures = compare(results, json.load(f), args.threshold)
+            if failures:
+                print('REGRESSIONS:')
+                for failure in failures:
+                    print('  ' + failure)
+                return 1
+            print('no regressions against baseline')
+        return 0
+    finally:
+        if args.keep:
+            print(f'database kept at {db_path}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, max_size=512, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class VersionedCache(TTLCache):
+    """TTLCache that empties itself whenever an external version changes
+
+    `load_version` is polled at most every `check_interval` seconds, so a
+    write made by any process (which bumps the version) is picked up by
+    every worker without a restart.
+    """
+
+    def __init__(self, load_version, max_size=512, ttl=300.0, check_interval=1.0):
+        super().__init__(max_size, ttl)
+        self.load_version = load_version
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = 0.0
+        self.invalidations = 0
+
+    def check_version(self):
+        """Current version, clearing the cache if it moved since last poll"""
+        now = time.monotonic()
+        if self.version is not None and now - self._checked_at < self.check_interval:
+            return self.version
+        version = self.load_version()
+        self._checked_at = now
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+        return version
+
+    def invalidate(self):
+        """Drop everything now and re-read the version on next access"""
+        self.clear()
+        self.version = None
+
+    def cached(self, fn):
+        """Decorator caching `fn` by its arguments"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            version = self.check_version()
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                # Don't store a result computed against an older catalog
+                if self.version == version:
+                    self.set(key, value)
+            return value
+        wrapper.uncached = fn
+        return wrapper
+
+    def stats(self):
+        stats = super().stats()
+        stats['version'] = self.version
+        stats['invalidations'] = self.invalidations
+        return stats
@@ -0,0 +1,360 @@
+"""Bulk catalog import/export
+
+    python catalog.py import products.csv
+    python catalog.py import products.jsonl --batch-size 10000
+    python catalog.py import products.csv --defer   # maintenance window only
+    python catalog.py export catalog.csv
+    python catalog.py reindex
+
+Imports stream the file and upsert by SKU in fixed-size batches, one
+short write transaction per batch, so memory stays flat and the site
+keeps serving while a large import runs.
+
+--defer is faster for very large loads: it drops the listing indexes and
+the full-text triggers for the import and rebuilds them at the end, each
+index in its own transaction and the search table in chunks. Meanwhile
+listings run without their indexes, search misses imported changes and
+every CREATE INDEX holds the write lock for a full table scan, so use it
+only in a maintenance window. The catalog version triggers stay live
+either way. If a deferred import is interrupted, `reindex` restores them.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from database import get_db_connection, index_pending_products, run_write_transaction
+from migrations import migrate
+
+FIELDS = ('sku', 'name', 'description', 'price', 'category', 'image_url',
+          'featured', 'in_stock', 'stock_quantity')
+BATCH_SIZE = 5000
+EXPORT_CHUNK_SIZE = 5000
+FTS_CHUNK_SIZE = 5000
+
+# Missing optional fields keep the stored value on update and get the
+# column default on insert (hence the numbered parameters)
+UPSERT_SQL = '''
+    INSERT INTO products (sku, name, description, price, category, image_url,
+                          featured, in_stock, stock_quantity)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, COALESCE(?7, 0), COALESCE(?8, 1), COALESCE(?9, 0))
+    ON CONFLICT (sku) DO UPDATE SET
+        name = excluded.name,
+        description = COALESCE(?3, description),
+        price = excluded.price,
+        category = excluded.category,
+        image_url = COALESCE(?6, image_url),
+        featured = COALESCE(?7, featured),
+        in_stock = COALESCE(?8, in_stock),
+        stock_quantity = COALESCE(?9, stock_quantity)
+'''
+
+# Maintained per row; cheaper to rebuild once after a bulk load. The
+# products_version_* triggers are not on the list: caches must see every
+# batch.
+DEFERRABLE_SQL = '''
+    SELECT type, name, sql FROM sqlite_master
+    WHERE tbl_name = 'products' AND sql IS NOT NULL AND (
+        (type = 'index' AND name GLOB 'idx_products_*' AND name != 'idx_products_sku')
+        OR (type = 'trigger' AND name GLOB 'products_fts_*')
+    )
+'''
+
+
+class RowError(ValueError):
+    pass
+
+
+def _flag(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y'):
+        return 1
+    if text in ('0', 'false', 'no', 'n'):
+        return 0
+    raise RowError(f'not a boolean: {value!r}')
+
+
+def _optional(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def to_row(record):
+    """Validate one CSV/JSONL record into UPSERT_SQL parameters"""
+    if not isinstance(record, dict):
+        raise RowError('expected an object')
+    sku, name, category = (_optional(record.get(k)) for k in ('sku', 'name', 'category'))
+    if not sku or not name or not category:
+        raise RowError('sku, name and category are required')
+    try:
+        price = float(record.get('price'))
+        stock = record.get('stock_quantity')
+        stock = None if stock in (None, '') else int(stock)
+    except (TypeError, ValueError):
+        raise RowError('price and stock_quantity must be numbers')
+    return (sku, name, _optional(record.get('description')), price, category,
+            _optional(record.get('image_url')), _flag(record.get('featured')),
+            _flag(record.get('in_stock')), stock)
+
+
+def read_records(stream, fmt):
+    """Yield (line number, record) from a CSV or JSONL stream, lazily"""
+    if fmt == 'csv':
+        for line_no, record in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, record
+        return
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f'invalid JSON: {e}')
+
+
+def defer_indexes():
+    """Set the listing indexes and FTS triggers aside; returns their names"""
+    def work(conn):
+        objects = conn.execute(DEFERRABLE_SQL).fetchall()
+        for obj in objects:
+            conn.execute('INSERT OR REPLACE INTO deferred_schema (name, sql) VALUES (?, ?)',
+                         (obj['name'], obj['sql']))
+            conn.execute(f'DROP {obj["type"].upper()} IF EXISTS "{obj["name"]}"')
+        return [obj['name'] for obj in objects]
+    return run_write_transaction(work)
+
+
+def _rebuild_fts(chunk_size=FTS_CHUNK_SIZE):
+    """Rebuild products_fts a range of ids per write transaction
+
+    Run with the FTS triggers in place, so rows written between chunks are
+    kept current by the triggers.
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT MAX(id) FROM products').fetchone()
+    conn.close()
+    max_id = max(row[0] or 0, 0)
+
+    def work(conn, lo, hi):
+        # Also drops entries of products deleted while the triggers were off
+        conn.execute('DELETE FROM products_fts WHERE rowid BETWEEN ? AND ?', (lo, hi))
+        conn.execute('''
+            INSERT INTO products_fts (rowid, name, description, category)
+            SELECT id, ar_normalize(name), ar_normalize(description), category
+            FROM products WHERE id BETWEEN ? AND ?
+        ''', (lo, hi))
+        conn.execute('DELETE FROM products_fts_pending WHERE product_id BETWEEN ? AND ?', (lo, hi))
+
+    for lo in range(0, max_id + 1, chunk_size):
+        run_write_transaction(lambda conn: work(conn, lo, lo + chunk_size - 1))
+    run_write_transaction(lambda conn: conn.execute(
+        'DELETE FROM products_fts WHERE rowid > ?', (max_id,)).rowcount)
+
+
+def restore_indexes():
+    """Recreate whatever defer_indexes() dropped and rebuild the FTS table
+
+    Each index and trigger is recreated in its own transaction, and the
+    full-text table is rebuilt in chunks, so no single write lock covers
+    the whole job. Bumps the catalog version once at the end, since search
+    results change only then.
+    """
+    conn = get_db_connection()
+    deferred = conn.execute('SELECT name, sql FROM deferred_schema').fetchall()
+    conn.close()
+    if not deferred:
+        return 0
+
+    def recreate(conn, obj):
+        conn.execute(obj['sql'])
+        conn.execute('DELETE FROM deferred_schema WHERE name = ?', (obj['name'],))
+
+    # Triggers first, so the chunked rebuild below never misses a write
+    triggers = [obj for obj in deferred if obj['name'].startswith('products_fts_')]
+    indexes = [obj for obj in deferred if not obj['name'].startswith('products_fts_')]
+    for obj in triggers:
+        run_write_transaction(lambda conn: recreate(conn, obj))
+    if triggers:
+        _rebuild_fts()
+    for obj in indexes:
+        run_write_transaction(lambda conn: recreate(conn, obj))
+    run_write_transaction(lambda conn: conn.execute(
+        'UPDATE catalog_meta SET version = version + 1 WHERE id = 1'))
+
+    conn = get_db_connection()
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return len(deferred)
+
+
+def _count_products():
+    conn = get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    conn.close()
+    return count
+
+
+def import_products(stream, fmt='csv', batch_size=BATCH_SIZE, defer=False, progress=None,
+                    max_errors=20):
+    """Upsert products by SKU from a CSV/JSONL stream
+
+    Rows are sent with executemany in batches of `batch_size`, each in its
+    own write transaction. `defer` sets the listing indexes and search
+    triggers aside until the end (see the module docstring). Invalid rows
+    are skipped and reported (the first `max_errors` of them). `progress(rows, seconds)` is called after every
+    batch. Returns a stats dict.
+    """
+    migrate()
+    before = _count_products()
+    started = time.perf_counter()
+    stats = {'rows': 0, 'skipped': 0, 'batches': 0, 'errors': []}
+
+    def write(conn, batch):
+        conn.executemany(UPSERT_SQL, batch)
+        # Search sees the batch as soon as it commits
+        index_pending_products(conn)
+
+    def flush(batch):
+        run_write_transaction(lambda conn: write(conn, batch))
+        stats['rows'] += len(batch)
+        stats['batches'] += 1
+        if progress:
+            progress(stats['rows'], time.perf_counter() - started)
+
+    if defer:
+        defer_indexes()
+    try:
+        batch = []
+        for line_no, record in read_records(stream, fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append(to_row(record))
+            except RowError as e:
+                stats['skipped'] += 1
+                if len(stats['errors']) < max_errors:
+                    stats['errors'].append(f'line {line_no}: {e}')
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if defer:
+            index_started = time.perf_counter()
+            restore_indexes()
+            stats['index_seconds'] = round(time.perf_counter() - index_started, 3)
+
+    seconds = time.perf_counter() - started
+    stats['inserted'] = _count_products() - before
+    stats['updated'] = stats['rows'] - stats['inserted']
+    stats['seconds'] = round(seconds, 3)
+    stats['rows_per_second'] = round(stats['rows'] / seconds) if seconds else None
+    return stats
+
+
+def iter_products(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the catalog in chunks of rows (lists), ordered by id
+
+    Each chunk is its own keyset query, so no read transaction stays open
+    across the whole export (which would stop WAL checkpoints).
+    """
+    last_id = 0
+    while True:
+        conn = get_db_connection()
+        rows = conn.execute(f'''
+            SELECT id, {', '.join(FIELDS)} FROM products
+            WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        conn.close()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield rows
+
+
+def export_products(stream, fmt='csv', chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """Write the catalog as CSV/JSONL (same columns import expects)"""
+    started = time.perf_counter()
+    count = 0
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+    for chunk in iter_products(chunk_size):
+        if writer:
+            writer.writerows([row[field] for field in FIELDS] for row in chunk)
+        else:
+            stream.writelines(json.dumps({field: row[field] for field in FIELDS},
+                                         ensure_ascii=False) + '\n' for row in chunk)
+        count += len(chunk)
+        if progress:
+            progress(count, time.perf_counter() - started)
+    seconds = time.perf_counter() - started
+    return {'rows': count, 'seconds': round(seconds, 3),
+            'rows_per_second': round(count / seconds) if seconds else None}
+
+
+def _format_for(path, fmt):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def _report(rows, seconds):
+    rate = rows / seconds if seconds else 0
+    print(f'\r{rows:,} rows  {rate:,.0f} rows/s', end='', file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk catalog import/export')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('import', help='upsert products by SKU from CSV/JSONL')
+    load.add_argument('path', help="file to read ('-' for stdin)")
+    load.add_argument('--format', choices=['csv', 'jsonl'])
+    load.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    load.add_argument('--defer', action='store_true',
+                      help='drop search/listing indexes until the end (maintenance window)')
+
+    dump = commands.add_parser('export', help='write the catalog as CSV/JSONL')
+    dump.add_argument('path', nargs='?', default='-', help="file to write (default stdout)")
+    dump.add_argument('--format', choices=['csv', 'jsonl'])
+    dump.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    commands.add_parser('reindex', help='restore indexes left behind by an interrupted import')
+    args = parser.parse_args(argv)
+
+    if args.command == 'reindex':
+        migrate()
+        print(f'تمت استعادة {restore_indexes()} فهرس/مشغل.')
+        return 0
+
+    fmt = _format_for(args.path, args.format)
+    if args.command == 'import':
+        stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8-sig', newline='')
+        with stream:
+            stats = import_products(stream, fmt, args.batch_size, args.defer, _report)
+        print(file=sys.stderr)
+        for error in stats.pop('errors'):
+            print(error, file=sys.stderr)
+    else:
+        stream = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+        with stream:
+            stats = export_products(stream, fmt, args.chunk_size,
+                                    _report if args.path != '-' else None)
+        if args.path != '-':
+            print(file=sys.stderr)
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,177 +1,168 @@
 import sqlite3
 import os
+import json
+import base64
+import random
+import time
 from datetime import datetime
+from flask import g, has_app_context
+from db_pool import ConnectionPool
+from arabic_text import normalize_arabic, tokenize
+from cache import TTLCache, VersionedCache
+from instrumentation import InstrumentedCursor, register_stats
 
-DATABASE_PATH = 'store.db'
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'store.db')
 
+# Pool settings are per process, so each gunicorn worker gets its own pool
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
 
-def init_db():
-    """Initialize the database with basic tables"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    # Products table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL,
-            category TEXT NOT NULL,
-            image_url TEXT,
-            featured BOOLEAN DEFAULT 0,
-            in_stock BOOLEAN DEFAULT 1,
-            stock_quantity INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            first_name TEXT,
-            last_name TEXT,
-            phone TEXT
-        )
-    ''')
-
-    # Cart items table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cart_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            product_id INTEGER NOT NULL,
-            quantity INTEGER DEFAULT 1,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (product_id) REFERENCES products (id)
-        )
-    ''')
-
-    # Wishlist table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS wishlist (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            product_id INTEGER NOT NULL,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
-            UNIQUE(user_id, product_id)
-        )
-    ''')
-    # Orders table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        total_price REAL NOT NULL,
-        status TEXT DEFAULT 'قيد الانتظار',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )
-''')
-    # Order items table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL,
-        price REAL NOT NULL,
-        FOREIGN KEY (order_id) REFERENCES orders(id),
-        FOREIGN KEY (product_id) REFERENCES products(id)
-    )
-''')
+# Listing pages
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+PRODUCT_SORTS = {
+    # name: (sort column, descending)
+    'newest': ('p.created_at', True),
+    'name': ('p.name', False),
+}
+# Queued products indexed per write transaction (refresh_search_index)
+SEARCH_INDEX_CHUNK = 5000
 
-    conn.commit()
-     # -------- مسح كل المنتجات القديمة --------
-    cursor.execute('DELETE FROM products')
-    conn.commit()
-    # Add sample products if empty
-    cursor.execute('SELECT COUNT(*) FROM products')
-    if cursor.fetchone()[0] == 0:
-        sample_products = [
-    ('هاتف ذكي متطور', 'هاتف ذكي بمواصفات عالية وتقنيات حديثة', 2500, 'إلكترونيات',
-     'uploads/تلفون.jpg', 1, 1, 10),
+# Catalog reads are cached per worker and dropped whenever catalog_meta's
+# version moves (triggers on products bump it, whichever process writes)
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', 512))
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', 300))
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 1))
 
-    ('لابتوب للألعاب', 'لابتوب قوي مخصص للألعاب والتصميم', 4500, 'إلكترونيات',
-     'uploads/لاب.avif', 1, 1, 5),
+# load_user runs on every authenticated request; keep a short-lived slim
+# copy of each user (no password hash) in memory instead of querying
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
 
-    ('ساعة ذكية', 'ساعة ذكية لتتبع اللياقة البدنية', 800, 'إكسسوارات',
-     'uploads/ساعة.avif', 1, 1, 15),
+# Write transactions (checkout, cancel) retry this often on lock contention
+WRITE_RETRIES = int(os.environ.get('WRITE_RETRIES', 5))
+WRITE_RETRY_BACKOFF = float(os.environ.get('WRITE_RETRY_BACKOFF', 0.05))
 
-    ('سماعات لاسلكية', 'سماعات بلوتوث عالية الجودة', 350, 'إكسسوارات',
-     'uploads/سماعة.jpeg', 0, 1, 20),
+ORDER_CANCELLED = 'تم الإلغاء'
 
-    ('كاميرا رقمية', 'كاميرا احترافية للتصوير', 3200, 'إلكترونيات',
-     'uploads/كاميرا.jpg', 1, 1, 8),
+_pool = None
 
-    ('جهاز لوحي', 'جهاز لوحي للعمل والترفيه', 1800, 'إلكترونيات',
-     'uploads/جهاز لوخي.avif', 1, 0, 0)
-]
 
-        cursor.executemany('''
-            INSERT INTO products (name, description, price, category, image_url, featured, in_stock, stock_quantity)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', sample_products)
+class InsufficientStockError(Exception):
+    """Raised by create_order when the cart asks for more than is in stock"""
 
-    conn.commit()
-    conn.close()
-def add_to_wishlist(user_id, product_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO wishlist (user_id, product_id) VALUES (?, ?)',
-                   (user_id, product_id))
-    conn.commit()
-    conn.close()
+    def __init__(self, products):
+        self.products = products  # names of the products that ran short
+        super().__init__(', '.join(products))
 
-def remove_from_wishlist(user_id, product_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM wishlist WHERE user_id=? AND product_id=?',
-                   (user_id, product_id))
-    conn.commit()
-    conn.close()
 
-def is_in_wishlist(user_id, product_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM wishlist WHERE user_id=? AND product_id=?',
-                   (user_id, product_id))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
-
-def get_wishlist_for_user(user_id):
-    """ترجع قائمة product_id للمستخدم"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT product_id FROM wishlist WHERE user_id=?', (user_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return [r[0] for r in results]
-#انشاء الطلب 
-def create_order(user_id):
-    """إنشاء طلب من محتوى السلة"""
+def init_db():
+    """Create or upgrade the schema (see migrations.py); never touches data"""
+    from migrations import migrate
+    migrate()
+
+def run_write_transaction(work):
+    """Run work(conn) inside BEGIN IMMEDIATE, retrying on lock contention
+
+    Taking the write lock up front means the transaction can't fail
+    half-way with "database is locked" after it has read. If the lock is
+    still busy after the busy timeout, back off (exponentially, with
+    jitter) and retry up to WRITE_RETRIES times.
+    """
     conn = get_db_connection()
-    
+    try:
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                result = work(conn)
+                conn.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if 'locked' not in str(e) and 'busy' not in str(e) or attempt == WRITE_RETRIES:
+                    raise
+                time.sleep(WRITE_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+    finally:
+        conn.close()
+
+def _record_sales(conn, order_id, sign):
+    """Add (sign=1) or take back (sign=-1) an order in the sales rollups
+
+    Runs inside the checkout/cancel transaction, so the rollups always
+    agree with the orders table. Categories are the products' current
+    ones; analytics.py backfill recomputes everything from history.
+    """
+    params = {'order_id': order_id, 'sign': sign}
+    conn.execute('''
+        INSERT INTO sales_daily (day, orders, units, revenue, cancelled_orders)
+        SELECT date(o.created_at), :sign, :sign * SUM(oi.quantity),
+               :sign * SUM(oi.quantity * oi.price), :sign < 0
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.id = :order_id
+        GROUP BY o.id
+        ON CONFLICT (day) DO UPDATE SET
+            orders = orders + excluded.orders, units = units + excluded.units,
+            revenue = revenue + excluded.revenue,
+            cancelled_orders = cancelled_orders + excluded.cancelled_orders
+    ''', params)
+    for table, key, expr in (('sales_product_daily', 'product_id', 'oi.product_id'),
+                             ('sales_category_daily', 'category', 'p.category')):
+        conn.execute(f'''
+            INSERT INTO {table} (day, {key}, orders, units, revenue)
+            SELECT date(o.created_at), {expr}, :sign, :sign * SUM(oi.quantity),
+                   :sign * SUM(oi.quantity * oi.price)
+            FROM orders o
+            JOIN order_items oi ON oi.order_id = o.id
+            JOIN products p ON p.id = oi.product_id
+            WHERE o.id = :order_id
+            GROUP BY {expr}
+            ON CONFLICT (day, {key}) DO UPDATE SET
+                orders = orders + excluded.orders, units = units + excluded.units,
+                revenue = revenue + excluded.revenue
+        ''', params)
+
+#انشاء الطلب 
+def _place_order(conn, user_id):
     # جلب عناصر السلة
     cart_items = conn.execute('''
-        SELECT ci.product_id, ci.quantity, p.price
+        SELECT ci.product_id, ci.quantity, p.price, p.name, p.stock_quantity
         FROM cart_items ci
         JOIN products p ON ci.product_id = p.id
-        WHERE ci.user_id = ?
+        WHERE ci.user_id = ? AND ci.quantity > 0
     ''', (user_id,)).fetchall()
     
     if not cart_items:
-        conn.close()
         return None  # السلة فارغة
 
+    # We hold the write lock, so this read can't go stale before the update
+    short = [item['name'] for item in cart_items if item['stock_quantity'] < item['quantity']]
+    if short:
+        raise InsufficientStockError(short)
+
+    # خصم المخزون: the WHERE guard refuses to go below zero regardless
+    cursor = conn.executemany('''
+        UPDATE products SET stock_quantity = stock_quantity - ?
+        WHERE id = ? AND stock_quantity >= ?
+    ''', [(item['quantity'], item['product_id'], item['quantity']) for item in cart_items])
+    if cursor.rowcount != len(cart_items):
+        raise InsufficientStockError([item['name'] for item in cart_items])
+
+    # Only touch in_stock on rows that actually sold out, so ordinary
+    # checkouts don't invalidate the catalog cache
+    product_ids = [item['product_id'] for item in cart_items]
+    placeholders = ','.join('?' * len(product_ids))
+    conn.execute(f'''
+        UPDATE products SET in_stock = 0
+        WHERE id IN ({placeholders}) AND stock_quantity <= 0 AND in_stock = 1
+    ''', product_ids)
+
     total_price = sum(item['quantity'] * item['price'] for item in cart_items)
     
     # إنشاء الطلب
@@ -182,81 +173,171 @@ def create_order(user_id):
     order_id = cursor.lastrowid
     
     # إضافة عناصر الطلب
-    for item in cart_items:
-        conn.execute('''
-            INSERT INTO order_items (order_id, product_id, quantity, price)
-            VALUES (?, ?, ?, ?)
-        ''', (order_id, item['product_id'], item['quantity'], item['price']))
+    conn.executemany('''
+        INSERT INTO order_items (order_id, product_id, quantity, price)
+        VALUES (?, ?, ?, ?)
+    ''', [(order_id, item['product_id'], item['quantity'], item['price']) for item in cart_items])
+    _record_sales(conn, order_id, 1)
     
     # مسح السلة بعد إنشاء الطلب
     conn.execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
-    
-    conn.commit()
-    conn.close()
     return order_id
 
+def create_order(user_id):
+    """إنشاء طلب من محتوى السلة
+
+    One immediate transaction: stock is decremented only where enough is
+    left, so concurrent checkouts can't oversell. Returns the order id,
+    None for an empty cart, and raises InsufficientStockError (with
+    nothing written) when any item is short.
+    """
+    return run_write_transaction(lambda conn: _place_order(conn, user_id))
+
 # جلب الطلبات الخاصة بالمستخدم
-def get_orders_for_user(user_id):
+def _group_orders(orders, items):
+    """Attach each order's items (rows carrying order_id) in Python"""
+    items_by_order = {}
+    for item in items:
+        item = dict(item)
+        items_by_order.setdefault(item.pop('order_id'), []).append(item)
+
+    return [{
+        'id': order['id'],
+        'total': order['total_price'],
+        'status': order['status'],
+        'created_at': order['created_at'],
+        'items': items_by_order.get(order['id'], [])  # <--- لازم تكون قائمة من الديكشنريز
+    } for order in orders]
+
+ORDERS_PAGE_SIZE = 10
+
+def get_order_history(user_id, cursor=None, limit=ORDERS_PAGE_SIZE):
+    """One page of a user's orders (newest first) with their items
+
+    Two queries whatever the page size: the orders page, then the items of
+    just those orders. Returns {'items', 'next_cursor', 'prev_cursor'}
+    where items are order dicts with their lines (see _group_orders).
+    """
     conn = get_db_connection()
-    orders = conn.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,)).fetchall()
-
-    result = []
-    for order in orders:
-        items = conn.execute('''
-            SELECT oi.quantity, oi.price, p.name, p.image_url
+    page = _keyset_page(conn, 'SELECT o.*, o.created_at AS sort_key FROM orders o',
+                        ['o.user_id = ?'], [user_id], 'o.created_at', True,
+                        cursor, clamp_page_size(limit), id_expr='o.id')
+    orders = page['items']
+    items = []
+    if orders:
+        placeholders = ','.join('?' * len(orders))
+        items = conn.execute(f'''
+            SELECT oi.order_id, oi.quantity, oi.price, p.name, p.image_url
             FROM order_items oi
             JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = ?
-        ''', (order['id'],)).fetchall()
-
-        items_list = [dict(item) for item in items]
-
-        result.append({
-            'id': order['id'],
-            'total': order['total_price'],
-            'status': order['status'],
-            'created_at': order['created_at'],
-            'items': items_list  # <--- لازم تكون قائمة من الديكشنريز
-        })
+            WHERE oi.order_id IN ({placeholders})
+        ''', [order['id'] for order in orders]).fetchall()
     conn.close()
-    return result
+    page['items'] = _group_orders(orders, items)
+    return page
 
 
 
 # إلغاء الطلب
-def cancel_order_by_id(user_id, order_id):
-    conn = get_db_connection()
+def _cancel_order(conn, user_id, order_id):
     # نتأكد أن الطلب يخص المستخدم وأن حالته لم يتم إلغاؤها مسبقاً
-    order = conn.execute('SELECT * FROM orders WHERE id = ? AND user_id = ?', (order_id, user_id)).fetchone()
-    if not order or order['status'] == 'تم الإلغاء':
-        conn.close()
+    cursor = conn.execute('''
+        UPDATE orders SET status = ? WHERE id = ? AND user_id = ? AND status != ?
+    ''', (ORDER_CANCELLED, order_id, user_id, ORDER_CANCELLED))
+    if cursor.rowcount == 0:
         return False
-    # تحديث الحالة
-    conn.execute('UPDATE orders SET status = ? WHERE id = ?', ('تم الإلغاء', order_id))
-    conn.commit()
-    conn.close()
+    _record_sales(conn, order_id, -1)
+    # إرجاع الكميات للمخزون
+    conn.execute('''
+        UPDATE products SET stock_quantity = stock_quantity + (
+            SELECT SUM(oi.quantity) FROM order_items oi
+            WHERE oi.order_id = ? AND oi.product_id = products.id
+        )
+        WHERE id IN (SELECT product_id FROM order_items WHERE order_id = ?)
+    ''', (order_id, order_id))
+    conn.execute('''
+        UPDATE products SET in_stock = 1
+        WHERE id IN (SELECT product_id FROM order_items WHERE order_id = ?)
+          AND stock_quantity > 0 AND in_stock = 0
+    ''', (order_id,))
     return True
 
+def cancel_order_by_id(user_id, order_id):
+    """Cancel a user's order and put its quantities back in stock"""
+    return run_write_transaction(lambda conn: _cancel_order(conn, user_id, order_id))
+
+def _setup_connection(conn):
+    """Per-connection setup: SQL functions used by queries (catalog.py reindex)"""
+    conn.create_function('ar_normalize', 1, normalize_arabic, deterministic=True)
+
+def get_pool():
+    """Get this process's connection pool, creating it on first use"""
+    global _pool
+    if _pool is None or _pool.database != DATABASE_PATH:
+        _pool = ConnectionPool(DATABASE_PATH, max_size=DB_POOL_SIZE,
+                               timeout=DB_POOL_TIMEOUT,
+                               busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                               cached_statements=DB_CACHED_STATEMENTS,
+                               on_connect=_setup_connection,
+                               cursor_factory=InstrumentedCursor)
+    return _pool
+
+def get_pool_stats():
+    """Checkouts, waits and open connections of the pool"""
+    return get_pool().stats()
+
 def get_db_connection():
-    """Get a database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # This allows us to access columns by name
-    return conn
+    """Get a database connection
+
+    Inside a Flask request every helper shares one pooled connection kept
+    in flask.g; close() on it is a no-op until close_db() runs at teardown.
+    Outside a request (scripts, init) the connection goes straight back to
+    the pool when closed.
+    """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = get_pool().acquire()
+            g.db.request_bound = True
+        return g.db
+    return get_pool().acquire()
+
+def close_db(exception=None):
+    """Return the request's connection to the pool (teardown handler)"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.request_bound = False
+        conn.close()
 
-def get_all_products():
-    """Get all products"""
+def get_catalog_version():
+    """Catalog version counter, bumped by every product write"""
     conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products ORDER BY created_at DESC').fetchall()
+    row = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()
     conn.close()
-    return products
+    return row['version'] if row else 0
+
+catalog_cache = VersionedCache(get_catalog_version, max_size=CATALOG_CACHE_SIZE,
+                               ttl=CATALOG_CACHE_TTL,
+                               check_interval=CATALOG_VERSION_CHECK_INTERVAL)
 
+def get_catalog_cache_stats():
+    """Hit/miss/eviction counters of the catalog cache"""
+    return catalog_cache.stats()
+
+register_stats('db_pool', get_pool_stats)
+register_stats('catalog_cache', get_catalog_cache_stats)
+
+@catalog_cache.cached
 def get_featured_products():
     """Get featured products"""
     conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products WHERE featured = 1 LIMIT 6').fetchall()
+    products = conn.execute('''
+        SELECT * FROM products WHERE featured = 1
+        ORDER BY created_at DESC, id DESC LIMIT 6
+    ''').fetchall()
     conn.close()
     return products
 
+@catalog_cache.cached
 def get_product_by_id(product_id):
     """Get a single product by ID"""
     conn = get_db_connection()
@@ -264,33 +345,153 @@ def get_product_by_id(product_id):
     conn.close()
     return product
 
-def search_products(query, category=None):
-    """Search products"""
-    conn = get_db_connection()
-    
+def _fts_query(query):
+    """Turn user input into an FTS5 query of quoted prefix terms"""
+    terms = tokenize(query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def index_pending_products(conn, limit=-1):
+    """Write the search rows of the products queued by the products_fts_* triggers
+
+    The text is normalized here rather than in the triggers, so products
+    can be written from any SQLite client (migration 15). Run inside a
+    write transaction; takes up to `limit` products (all by default) off
+    the queue and returns how many.
+    """
+    ids = conn.execute('SELECT product_id FROM products_fts_pending ORDER BY product_id LIMIT ?',
+                       (limit,)).fetchall()
+    if not ids:
+        return 0
+    bounds = (ids[0][0], ids[-1][0])
+    queued = 'SELECT product_id FROM products_fts_pending WHERE product_id BETWEEN ? AND ?'
+    conn.execute(f'DELETE FROM products_fts WHERE rowid IN ({queued})', bounds)
+    rows = conn.execute(f'SELECT id, name, description, category FROM products WHERE id IN ({queued})',
+                        bounds).fetchall()
+    conn.executemany('INSERT INTO products_fts (rowid, name, description, category) VALUES (?, ?, ?, ?)',
+                     [(row['id'], normalize_arabic(row['name']), normalize_arabic(row['description']),
+                       row['category']) for row in rows])
+    conn.execute('DELETE FROM products_fts_pending WHERE product_id BETWEEN ? AND ?', bounds)
+    return len(ids)
+
+def refresh_search_index(chunk_size=SEARCH_INDEX_CHUNK):
+    """Index every queued product, one short write transaction per chunk"""
+    total = 0
+    while True:
+        count = run_write_transaction(lambda conn: index_pending_products(conn, chunk_size))
+        total += count
+        if count < chunk_size:
+            return total
+
+def encode_cursor(key, direction='next'):
+    """Opaque ?cursor= value for the row with sort key `key`"""
+    raw = json.dumps([direction] + list(key), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (direction, key); a missing or malformed cursor means page one"""
+    if not cursor:
+        return 'next', None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, *key = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        return 'next', None
+    if direction not in ('next', 'prev') or len(key) != 2:
+        return 'next', None
+    return direction, key
+
+def clamp_page_size(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def _keyset_page(conn, select, conditions, params, sort_expr, descending, cursor, limit,
+                 id_expr='p.id'):
+    """Run one keyset-paginated query ordered by (sort_expr, id_expr)
+
+    `select` must expose the sort value as sort_key. Going backwards
+    flips the comparison and the ORDER BY, then reverses the rows, so
+    both directions stay an index range scan.
+    """
+    direction, key = decode_cursor(cursor)
+    backwards = key is not None and direction == 'prev'
+    desc = descending != backwards
+
+    conditions = list(conditions)
+    params = list(params)
+    if key is not None:
+        conditions.append(f'({sort_expr}, {id_expr}) {"<" if desc else ">"} (?, ?)')
+        params.extend(key)
+
+    sql = select
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    order = 'DESC' if desc else 'ASC'
+    sql += f' ORDER BY {sort_expr} {order}, {id_expr} {order} LIMIT ?'
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    has_next = more if not backwards else True
+    has_prev = more if backwards else key is not None
+    return {
+        'items': rows,
+        'next_cursor': encode_cursor((rows[-1]['sort_key'], rows[-1]['id'])) if rows and has_next else None,
+        'prev_cursor': encode_cursor((rows[0]['sort_key'], rows[0]['id']), 'prev') if rows and has_prev else None,
+    }
+
+@catalog_cache.cached
+def get_products_page(category=None, sort='newest', cursor=None, limit=PAGE_SIZE):
+    """One page of the catalog (optionally one category), keyset-paginated
+
+    Returns {'items', 'next_cursor', 'prev_cursor'}.
+    """
+    sort_expr, descending = PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest'])
+    conditions, params = [], []
     if category:
-        products = conn.execute('''
-            SELECT * FROM products 
-            WHERE (name LIKE ? OR description LIKE ?) AND category = ?
-            ORDER BY name
-        ''', (f'%{query}%', f'%{query}%', category)).fetchall()
-    else:
-        products = conn.execute('''
-            SELECT * FROM products 
-            WHERE name LIKE ? OR description LIKE ?
-            ORDER BY name
-        ''', (f'%{query}%', f'%{query}%')).fetchall()
-    
+        conditions.append('p.category = ?')
+        params.append(category)
+
+    conn = get_db_connection()
+    page = _keyset_page(conn, f'SELECT p.*, {sort_expr} AS sort_key FROM products p',
+                        conditions, params, sort_expr, descending,
+                        cursor, clamp_page_size(limit))
     conn.close()
-    return products
+    return page
+
+def search_products_page(query, category=None, cursor=None, limit=PAGE_SIZE):
+    """One page of search results, best matches first
+
+    Same result shape as get_products_page(); pages on (rank, id).
+    """
+    match = _fts_query(query)
+    if not match:
+        return {'items': [], 'next_cursor': None, 'prev_cursor': None}
+
+    conditions, params = ['products_fts MATCH ?'], [match]
+    if category:
+        conditions.append('products_fts.category = ?')
+        params.append(category)
 
-def get_products_by_category(category):
-    """Get products by category"""
     conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products WHERE category = ?', (category,)).fetchall()
+    # Products written since the last search (by any client) go in first
+    if conn.execute('SELECT 1 FROM products_fts_pending LIMIT 1').fetchone():
+        refresh_search_index()
+    # rank is bm25() with name weighted over description (migration 3)
+    page = _keyset_page(conn, '''
+        SELECT p.*, products_fts.rank AS sort_key FROM products_fts
+        JOIN products p ON p.id = products_fts.rowid
+    ''', conditions, params, 'products_fts.rank', False,
+                        cursor, clamp_page_size(limit))
     conn.close()
-    return products
+    return page
 
+@catalog_cache.cached
 def get_categories():
     """Get all unique categories"""
     conn = get_db_connection()
@@ -298,17 +499,6 @@ def get_categories():
     conn.close()
     return [cat['category'] for cat in categories]
 
-def get_related_products(product_id, category):
-    """Get related products from same category"""
-    conn = get_db_connection()
-    products = conn.execute('''
-        SELECT * FROM products 
-        WHERE category = ? AND id != ? 
-        LIMIT 4
-    ''', (category, product_id)).fetchall()
-    conn.close()
-    return products
-
 # User functions
 def create_user(username, email, password_hash, first_name=None, last_name=None, phone=None):
     """Create a new user"""
@@ -340,6 +530,66 @@ def get_user_by_id(user_id):
     conn.close()
     return user
 
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+register_stats('user_cache', user_cache.stats)
+
+def get_user_identity(user_id):
+    """Slim user projection for the login loader, cached for USER_CACHE_TTL
+
+    Leaves out password_hash. Other workers may serve a stale copy for at
+    most the TTL after a change; the worker making the change drops its
+    copy at once.
+    """
+    user = user_cache.get(user_id)
+    if user is None:
+        conn = get_db_connection()
+        row = conn.execute('''
+            SELECT id, username, email, first_name, last_name, phone, created_at
+            FROM users WHERE id = ?
+        ''', (user_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        user = dict(row)
+        user_cache.set(user_id, user)
+    return user
+
+def invalidate_user(user_id):
+    """Forget the cached identity of a user after it changed"""
+    user_cache.delete(int(user_id))
+
+def update_user_profile(user_id, first_name=None, last_name=None, phone=None, email=None):
+    """Update a user's profile fields; returns False if the email is taken"""
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            UPDATE users SET first_name = ?, last_name = ?, phone = ?,
+                             email = COALESCE(?, email)
+            WHERE id = ?
+        ''', (first_name, last_name, phone, email, user_id))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.close()
+        return False
+    conn.close()
+    invalidate_user(user_id)
+    return True
+
+def update_user_password(user_id, password_hash):
+    """Store a new password hash for a user"""
+    conn = get_db_connection()
+    conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+    conn.commit()
+    conn.close()
+    invalidate_user(user_id)
+
+def record_login(user_id):
+    """Remember when a user last logged in (retention, see purge_users.py)"""
+    conn = get_db_connection()
+    conn.execute('UPDATE users SET last_login_at = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
+    conn.commit()
+    conn.close()
+
 def get_user_by_email(email):
     """Get user by email"""
     conn = get_db_connection()
@@ -348,67 +598,159 @@ def get_user_by_email(email):
     return user
 
 # Cart functions
+def _cart_count(conn, user_id):
+    """Badge count, read inside the caller's transaction"""
+    return conn.execute('''
+        SELECT COALESCE(SUM(quantity), 0) FROM cart_items WHERE user_id = ?
+    ''', (user_id,)).fetchone()[0]
+
 def add_to_cart(user_id, product_id, quantity=1):
-    """Add item to cart"""
+    """Add item to cart
+
+    One UPSERT that only matches in-stock products, plus the new badge
+    count from the same transaction. Returns that count, or None when the
+    product doesn't exist or is out of stock. Raises ValueError unless
+    `quantity` is a positive integer.
+    """
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+        raise ValueError('quantity must be a positive integer')
     conn = get_db_connection()
-    
-    # Check if item already exists
-    existing = conn.execute('''
-        SELECT * FROM cart_items WHERE user_id = ? AND product_id = ?
-    ''', (user_id, product_id)).fetchone()
-    
-    if existing:
-        # Update quantity
-        conn.execute('''
-            UPDATE cart_items SET quantity = quantity + ? WHERE user_id = ? AND product_id = ?
-        ''', (quantity, user_id, product_id))
-    else:
-        # Add new item
-        conn.execute('''
-            INSERT INTO cart_items (user_id, product_id, quantity)
-            VALUES (?, ?, ?)
-        ''', (user_id, product_id, quantity))
-    
+    cursor = conn.execute('''
+        INSERT INTO cart_items (user_id, product_id, quantity)
+        SELECT ?, id, ? FROM products WHERE id = ? AND in_stock = 1
+        ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    ''', (user_id, quantity, product_id))
+    if cursor.rowcount == 0:
+        conn.close()
+        return None
+    count = _cart_count(conn, user_id)
     conn.commit()
     conn.close()
+    return count
 
-def get_cart_items(user_id):
-    """Get all cart items for a user"""
-    conn = get_db_connection()
+def _cart_summary(conn, user_id):
     items = conn.execute('''
         SELECT ci.*, p.name, p.price, p.image_url, p.category, p.in_stock,
-               (ci.quantity * p.price) as total_price
+               (ci.quantity * p.price) as total_price,
+               SUM(ci.quantity * p.price) OVER () AS cart_total,
+               SUM(ci.quantity) OVER () AS cart_count
         FROM cart_items ci
         JOIN products p ON ci.product_id = p.id
         WHERE ci.user_id = ?
         ORDER BY ci.added_at DESC
     ''', (user_id,)).fetchall()
+    return {
+        'items': items,
+        'total_price': items[0]['cart_total'] if items else 0,
+        'total_items': items[0]['cart_count'] if items else 0
+    }
+
+def get_cart_summary(user_id):
+    """Cart items, total price and item count in a single query
+
+    Returns the dict cart.html expects: items, total_price, total_items.
+    """
+    conn = get_db_connection()
+    summary = _cart_summary(conn, user_id)
     conn.close()
-    return items
+    return summary
 
-def get_cart_count(user_id):
-    """Get total items count in cart"""
+MAX_CART_BATCH = 100
+
+def _cart_operation(conn, user_id, operation):
+    """Apply one /cart/batch operation; returns whether it changed anything"""
+    op = operation.get('op')
+    quantity = operation.get('quantity', 1)
+    if op == 'add':
+        return conn.execute('''
+            INSERT INTO cart_items (user_id, product_id, quantity)
+            SELECT ?, id, ? FROM products WHERE id = ? AND in_stock = 1
+            ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        ''', (user_id, quantity, operation['product_id'])).rowcount > 0
+    if op == 'remove' or (op == 'update' and quantity <= 0):
+        return conn.execute('DELETE FROM cart_items WHERE id = ? AND user_id = ?',
+                            (operation['item_id'], user_id)).rowcount > 0
+    return conn.execute('UPDATE cart_items SET quantity = ? WHERE id = ? AND user_id = ?',
+                        (quantity, operation['item_id'], user_id)).rowcount > 0
+
+# Integer fields each /cart/batch operation must carry (add's quantity defaults to 1)
+CART_OPERATION_FIELDS = {
+    'add': ('product_id',),
+    'update': ('item_id', 'quantity'),
+    'remove': ('item_id',),
+}
+
+def _validate_cart_operation(operation):
+    if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATION_FIELDS:
+        raise ValueError('unknown cart operation')
+    fields = CART_OPERATION_FIELDS[operation['op']]
+    if operation['op'] == 'add' and 'quantity' in operation:
+        fields += ('quantity',)
+    for field in fields:
+        value = operation.get(field)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f'{field} must be an integer')
+    if operation['op'] == 'add' and operation.get('quantity', 1) <= 0:
+        raise ValueError('quantity must be positive')
+
+def apply_cart_batch(user_id, operations):
+    """Apply add/update/remove operations, in order, in one transaction
+
+    Each operation is {'op': 'add', 'product_id', 'quantity'?},
+    {'op': 'update', 'item_id', 'quantity'} (0 removes) or
+    {'op': 'remove', 'item_id'}. Raises ValueError (before writing
+    anything) for malformed input. Returns {'results': [bool per op],
+    'summary': cart summary read in the same transaction}.
+    """
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_CART_BATCH:
+        raise ValueError(f'expected 1..{MAX_CART_BATCH} operations')
+    for operation in operations:
+        _validate_cart_operation(operation)
+
+    def work(conn):
+        results = [_cart_operation(conn, user_id, operation) for operation in operations]
+        return {'results': results, 'summary': _cart_summary(conn, user_id)}
+
+    return run_write_transaction(work)
+
+def get_user_state_version(user_id):
+    """Counter bumped (by triggers) on every change to a user's cart or wishlist"""
     conn = get_db_connection()
-    result = conn.execute('''
-        SELECT SUM(quantity) as total FROM cart_items WHERE user_id = ?
+    row = conn.execute('SELECT version FROM user_state WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row['version'] if row else 0
+
+def get_user_page_state(user_id):
+    """State version, cart count and wishlist IDs of a user, in one statement
+
+    Everything base.html needs for a logged-in page, read from one
+    consistent snapshot.
+    """
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT
+            (SELECT version FROM user_state WHERE user_id = ?1) AS version,
+            (SELECT COALESCE(SUM(quantity), 0) FROM cart_items WHERE user_id = ?1) AS cart_count,
+            (SELECT json_group_array(product_id) FROM wishlist WHERE user_id = ?1) AS wishlist
     ''', (user_id,)).fetchone()
     conn.close()
-    return result['total'] if result['total'] else 0
+    return {
+        'version': row['version'] or 0,
+        'cart_count': row['cart_count'],
+        'wishlist': json.loads(row['wishlist']),
+    }
 
-def get_cart_total(user_id):
-    """Get total price of cart"""
+def get_cart_count(user_id):
+    """Get total items count in cart"""
     conn = get_db_connection()
     result = conn.execute('''
-        SELECT SUM(ci.quantity * p.price) as total
-        FROM cart_items ci
-        JOIN products p ON ci.product_id = p.id
-        WHERE ci.user_id = ?
+        SELECT SUM(quantity) as total FROM cart_items WHERE user_id = ?
     ''', (user_id,)).fetchone()
     conn.close()
     return result['total'] if result['total'] else 0
 
 def update_cart_item(item_id, quantity, user_id):
-    """Update cart item quantity"""
+    """Update cart item quantity; returns the new cart count"""
     conn = get_db_connection()
     if quantity <= 0:
         conn.execute('DELETE FROM cart_items WHERE id = ? AND user_id = ?', (item_id, user_id))
@@ -416,19 +758,23 @@ def update_cart_item(item_id, quantity, user_id):
         conn.execute('''
             UPDATE cart_items SET quantity = ? WHERE id = ? AND user_id = ?
         ''', (quantity, item_id, user_id))
+    count = _cart_count(conn, user_id)
     conn.commit()
     conn.close()
+    return count
 
 def remove_cart_item(item_id, user_id):
-    """Remove item from cart"""
+    """Remove item from cart; returns the new cart count"""
     conn = get_db_connection()
     conn.execute('DELETE FROM cart_items WHERE id = ? AND user_id = ?', (item_id, user_id))
+    count = _cart_count(conn, user_id)
     conn.commit()
     conn.close()
+    return count
 
 def clear_cart(user_id):
     """Clear all items from cart"""
     conn = get_db_connection()
     conn.execute('DELETE FROM cart_items WHERE user_id = ?', (user_id,))
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool
+
+    The helpers in database.py all end with conn.close(); for pooled
+    connections that rolls back any unfinished transaction and then
+    either returns the connection to the pool or, when it is bound to the
+    current Flask request, keeps it open until teardown.
+    """
+
+    pool = None
+    request_bound = False
+    cursor_factory = sqlite3.Cursor
+
+    # conn.execute() doesn't go through cursor(), so route both explicitly
+    # to let the pool's cursor_factory (e.g. instrumentation) see every query
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        if self.request_bound:
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pre-configured SQLite connections"""
+
+    def __init__(self, database, max_size=5, timeout=10.0,
+                 busy_timeout_ms=5000, cached_statements=256, on_connect=None,
+                 cursor_factory=None):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.on_connect = on_connect
+        self.cursor_factory = cursor_factory
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._pid = os.getpid()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        if self.cursor_factory is not None:
+            conn.cursor_factory = self.cursor_factory
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        conn.pool = self
+        return conn
+
+    def _check_fork(self):
+        # A forked gunicorn worker must never reuse its parent's handles
+        if self._pid != os.getpid():
+            self._cond = threading.Condition()
+            self._idle = []
+            self._open = 0
+            self._pid = os.getpid()
+
+    def acquire(self):
+        """Check a connection out, waiting up to `timeout` seconds"""
+        self._check_fork()
+        with self._cond:
+            self._checkouts += 1
+            if not self._idle and self._open >= self.max_size:
+                self._waits += 1
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._wait_time += time.monotonic() - started
+                        raise PoolTimeout(
+                            f'no free connection after {self.timeout}s '
+                            f'(max_size={self.max_size})')
+                    self._cond.wait(remaining)
+                self._wait_time += time.monotonic() - started
+            if self._idle:
+                conn = self._idle.pop()
+                conn.request_bound = False
+                return conn
+            self._open += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        conn.request_bound = False
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def discard(self, conn):
+        """Drop a broken connection instead of reusing it"""
+        try:
+            conn.really_close()
+        finally:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.really_close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_seconds': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+            }
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from markupsafe import Markup, escape
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; without it pages use the originals
+    Image = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DERIVED_DIR = 'derived'  # relative to STATIC_DIR
+MANIFEST_PATH = os.path.join(STATIC_DIR, DERIVED_DIR, 'manifest.json')
+
+# Widths generated for every product image (never upscaled)
+WIDTHS = (160, 320, 640)
+QUALITY = {'avif': 50, 'webp': 75}
+CARD_SIZES = '(min-width: 992px) 300px, (min-width: 768px) 45vw, 100vw'
+PLACEHOLDER = ('data:image/svg+xml,%3Csvg xmlns=%22http://www.w3.org/2000/svg%22 '
+               'viewBox=%220 0 4 3%22%3E%3Crect width=%224%22 height=%223%22 fill=%22%23eee%22/%3E%3C/svg%3E')
+# How often a worker re-checks the manifest file for new entries
+MANIFEST_CHECK_INTERVAL = 5.0
+
+
+def available_formats():
+    """Modern formats this Pillow build can encode, best first"""
+    if Image is None:
+        return []
+    return [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+
+
+def _load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp = MANIFEST_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _static_path(image_url):
+    """Absolute path of `image_url` under STATIC_DIR, or None if it points elsewhere
+
+    image_url comes from the catalog (catalog.py import), so absolute
+    paths, ../ and symlinks out of static/ are refused.
+    """
+    root = os.path.realpath(STATIC_DIR)
+    path = os.path.realpath(os.path.join(root, image_url))
+    if os.path.commonpath([root, path]) != root or path == root:
+        return None
+    return path
+
+
+def build_derivatives(image_url, manifest=None):
+    """Generate the resized AVIF/WebP variants of one static image
+
+    Derivatives are named after a hash of the original's bytes, so they
+    are ASCII-safe and a changed image gets new names. Returns the
+    manifest entry, or None if the image is missing, outside static/ or
+    Pillow isn't installed.
+    """
+    formats = available_formats()
+    source = _static_path(image_url)
+    if not formats or source is None or not os.path.isfile(source):
+        return None
+
+    with open(source, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    if manifest and manifest.get(image_url, {}).get('hash') == digest:
+        return manifest[image_url]
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    width, height = image.size
+
+    out_dir = os.path.join(STATIC_DIR, DERIVED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    variants = {fmt: {} for fmt in formats}
+    for target in sorted({min(w, width) for w in WIDTHS}):
+        resized = image if target == width else image.resize(
+            (target, max(1, round(height * target / width))), Image.LANCZOS)
+        for fmt in formats:
+            name = f'{digest}-{target}.{fmt}'
+            path = os.path.join(out_dir, name)
+            if not os.path.exists(path):
+                resized.save(path + '.tmp', format=fmt.upper(), quality=QUALITY[fmt])
+                os.replace(path + '.tmp', path)
+            variants[fmt][str(target)] = f'{DERIVED_DIR}/{name}'
+
+    return {'hash': digest, 'width': width, 'height': height, 'variants': variants}
+
+
+def process_pending(process_all=False):
+    """Build derivatives for images queued by the products triggers
+
+    The image_jobs table is filled whenever a product's image_url is
+    inserted or changed (see migrations.py); with process_all every
+    product image is (re)checked instead. Returns the number processed.
+    """
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    if process_all:
+        urls = [row[0] for row in conn.execute(
+            'SELECT DISTINCT image_url FROM products WHERE image_url IS NOT NULL')]
+    else:
+        urls = [row[0] for row in conn.execute('SELECT image_url FROM image_jobs')]
+    conn.close()
+    if not urls or not available_formats():
+        return 0
+
+    manifest = _load_manifest()
+    for url in urls:
+        entry = build_derivatives(url, manifest)
+        if entry:
+            manifest[url] = entry
+    _save_manifest(manifest)
+
+    conn = get_db_connection()
+    conn.executemany('DELETE FROM image_jobs WHERE image_url = ?', [(url,) for url in urls])
+    conn.commit()
+    conn.close()
+    return len(urls)
+
+
+class _Manifest:
+    """Per-worker copy of the manifest, reloaded when the file changes"""
+
+    def __init__(self):
+        self.data = {}
+        self.mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, image_url):
+        now = time.monotonic()
+        if now - self.checked_at >= MANIFEST_CHECK_INTERVAL:
+            with self.lock:
+                self.checked_at = now
+                try:
+                    mtime = os.path.getmtime(MANIFEST_PATH)
+                except OSError:
+                    mtime = None
+                if mtime != self.mtime:
+                    self.data = _load_manifest()
+                    self.mtime = mtime
+        return self.data.get(image_url)
+
+
+_manifest = _Manifest()
+
+
+def product_image(image_url, alt='', css_class='card-img-top', sizes=CARD_SIZES,
+                  style=None, eager=False):
+    """Jinja helper: <picture> with AVIF/WebP srcsets for a static image
+
+    Falls back to a plain lazy <img> of the original when no derivatives
+    exist yet.
+    """
+    from flask import url_for
+
+    loading = 'eager' if eager else 'lazy'
+    attrs = f'class="{escape(css_class)}" alt="{escape(alt)}"'
+    if style:
+        attrs += f' style="{escape(style)}"'
+    if not image_url:
+        return Markup(f'<img src="{PLACEHOLDER}" {attrs}>')
+
+    original = url_for('static', filename=image_url)
+    entry = _manifest.get(image_url)
+    if not entry:
+        return Markup(f'<img src="{escape(original)}" {attrs} loading="{loading}" decoding="async">')
+
+    sources = []
+    for fmt, by_width in entry['variants'].items():
+        srcset = ', '.join(f"{url_for('static', filename=path)} {width}w"
+                           for width, path in sorted(by_width.items(), key=lambda kv: int(kv[0])))
+        sources.append(f'<source type="image/{fmt}" srcset="{escape(srcset)}" sizes="{escape(sizes)}">')
+    return Markup(
+        '<picture>' + ''.join(sources)
+        + f'<img src="{escape(original)}" {attrs} '
+        f'width="{entry["width"]}" height="{entry["height"]}" '
+        f'loading="{loading}" decoding="async"></picture>')
+
+
+if __name__ == '__main__':
+    if not available_formats():
+        print('Pillow (with WebP/AVIF support) غير مثبت: pip install pillow')
+        sys.exit(1)
+    process_all = '--all' in sys.argv
+    count = process_pending(process_all)
+    print(f'تمت معالجة {count} صورة.')
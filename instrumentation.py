@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from flask import g, request, has_request_context, template_rendered, before_render_template
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# A request running the same statement more often than this is flagged N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('store.slow_query')
+n_plus_one_log = logging.getLogger('store.n_plus_one')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """SQL with literals and IN-lists folded, for grouping and logs"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(?...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class _Metrics:
+    """Process-wide counters; each gunicorn worker exposes its own"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}        # (endpoint, method) -> _Histogram
+        self.requests = Counter()  # (endpoint, method, status)
+        self.queries = Counter()   # endpoint
+        self.sql_seconds = Counter()
+        self.template_seconds = Counter()
+        self.slow_queries = Counter()
+        self.n_plus_one = Counter()
+        self.stats_sources = {}
+
+    def record_request(self, endpoint, method, status, seconds, queries, sql_seconds,
+                       template_seconds):
+        with self.lock:
+            key = (endpoint, method)
+            if key not in self.latency:
+                self.latency[key] = _Histogram()
+            self.latency[key].observe(seconds)
+            self.requests[(endpoint, method, status)] += 1
+            self.queries[endpoint] += queries
+            self.sql_seconds[endpoint] += sql_seconds
+            self.template_seconds[endpoint] += template_seconds
+
+
+metrics = _Metrics()
+
+
+def register_stats(name, fn):
+    """Expose the numeric values of fn() (a dict) as store_<name>_<key> gauges"""
+    metrics.stats_sources[name] = fn
+
+
+def _explain(conn, sql, parameters):
+    try:
+        cursor = sqlite3.Cursor(conn)
+        return [row[3] for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+    except sqlite3.Error:
+        return None
+
+
+def _record_query(cursor, sql, parameters, seconds):
+    endpoint = None
+    if has_request_context():
+        endpoint = request.endpoint
+        g.setdefault('sql_queries', 0)
+        g.sql_queries += 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+        if 'sql_statements' not in g:
+            g.sql_statements = Counter()
+        g.sql_statements[normalize_sql(sql)] += 1
+
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        with metrics.lock:
+            metrics.slow_queries[endpoint] += 1
+        statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        plan = None
+        if statement in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+            plan = _explain(cursor.connection, sql, parameters)
+        slow_query_log.warning(json.dumps({
+            'event': 'slow_query',
+            'route': endpoint,
+            'ms': round(seconds * 1000, 3),
+            'sql': normalize_sql(sql),
+            'plan': plan,
+        }, ensure_ascii=False))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times every statement (including fetches) it runs"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(self, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            first = seq_of_parameters[0] if seq_of_parameters else ()
+            _record_query(self, sql, first, time.perf_counter() - started)
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if has_request_context():
+                g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('template_depth', 0)
+    if g.template_depth == 0:
+        g.template_started = time.perf_counter()
+    g.template_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    g.template_depth -= 1
+    if g.template_depth == 0:
+        g.template_seconds = g.get('template_seconds', 0.0) + time.perf_counter() - g.template_started
+
+
+def _after_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    queries = g.get('sql_queries', 0)
+    sql_seconds = g.get('sql_seconds', 0.0)
+    template_seconds = g.get('template_seconds', 0.0)
+    metrics.record_request(endpoint, request.method, response.status_code, seconds,
+                           queries, sql_seconds, template_seconds)
+
+    for sql, count in g.get('sql_statements', Counter()).items():
+        if count > N_PLUS_ONE_THRESHOLD:
+            with metrics.lock:
+                metrics.n_plus_one[endpoint] += 1
+            n_plus_one_log.warning(json.dumps({
+                'event': 'n_plus_one',
+                'route': endpoint,
+                'count': count,
+                'sql': sql,
+            }, ensure_ascii=False))
+
+    response.headers['Server-Timing'] = (
+        f'db;dur={sql_seconds * 1000:.2f};desc="{queries} queries", '
+        f'tpl;dur={template_seconds * 1000:.2f}, '
+        f'total;dur={seconds * 1000:.2f}')
+    return response
+
+
+def init_app(app):
+    """Hook request timing, template timing and query counting into `app`"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+
+def _labels(**labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def render_metrics():
+    """Prometheus text exposition of this process's metrics"""
+    lines = []
+    with metrics.lock:
+        lines.append('# HELP store_request_duration_seconds Request latency per route')
+        lines.append('# TYPE store_request_duration_seconds histogram')
+        for (endpoint, method), hist in sorted(metrics.latency.items()):
+            for bound, count in zip(LATENCY_BUCKETS, hist.buckets):
+                lines.append('store_request_duration_seconds_bucket'
+                             + _labels(route=endpoint, method=method, le=bound) + f' {count}')
+            lines.append('store_request_duration_seconds_bucket'
+                         + _labels(route=endpoint, method=method, le='+Inf') + f' {hist.count}')
+            lines.append('store_request_duration_seconds_sum'
+                         + _labels(route=endpoint, method=method) + f' {hist.total:.6f}')
+            lines.append('store_request_duration_seconds_count'
+                         + _labels(route=endpoint, method=method) + f' {hist.count}')
+
+        lines.append('# HELP store_requests_total Requests per route and status')
+        lines.append('# TYPE store_requests_total counter')
+        for (endpoint, method, status), count in sorted(metrics.requests.items()):
+            lines.append('store_requests_total'
+                         + _labels(route=endpoint, method=method, status=status) + f' {count}')
+
+        for name, help_text, counter, fmt in (
+                ('store_sql_queries_total', 'SQL statements run per route', metrics.queries, '{}'),
+                ('store_sql_seconds_total', 'Time spent in SQLite per route', metrics.sql_seconds, '{:.6f}'),
+                ('store_template_seconds_total', 'Time spent rendering templates per route',
+                 metrics.template_seconds, '{:.6f}'),
+                ('store_slow_queries_total', f'Queries slower than {SLOW_QUERY_MS}ms',
+                 metrics.slow_queries, '{}'),
+                ('store_n_plus_one_total',
+                 f'Requests repeating a statement more than {N_PLUS_ONE_THRESHOLD} times',
+                 metrics.n_plus_one, '{}')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for endpoint, value in sorted(counter.items(), key=lambda kv: str(kv[0])):
+                lines.append(name + _labels(route=endpoint or 'none') + ' ' + fmt.format(value))
+
+        sources = list(metrics.stats_sources.items())
+
+    for source, fn in sources:
+        for key, value in fn().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE store_{source}_{key} gauge')
+            lines.append(f'store_{source}_{key} {value}')
+    return '\n'.join(lines) + '\n'
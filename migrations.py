@@ -0,0 +1,468 @@
+import sqlite3
+import time
+from database import get_db_connection
+
+# How long a worker waits for another process that is already migrating
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+def _add_users_created_at(conn):
+    """Older databases were created without users.created_at"""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(users)')]
+    if 'created_at' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP')
+
+
+def _add_products_sku(conn):
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(products)')]
+    if 'sku' not in columns:
+        conn.execute('ALTER TABLE products ADD COLUMN sku TEXT')
+
+
+def _add_users_last_login(conn):
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(users)')]
+    if 'last_login_at' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN last_login_at TIMESTAMP')
+
+
+# Plain SQL, so any SQLite client can write products: they only queue the
+# row, and database.index_pending_products() adds the normalized text
+FTS_QUEUE_TRIGGERS = {
+    'products_fts_insert': '''
+        CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT OR IGNORE INTO products_fts_pending (product_id) VALUES (new.id);
+        END
+    ''',
+    'products_fts_update': '''
+        CREATE TRIGGER products_fts_update
+        AFTER UPDATE OF name, description, category ON products BEGIN
+            INSERT OR IGNORE INTO products_fts_pending (product_id) VALUES (new.id);
+        END
+    ''',
+}
+
+
+def _queue_fts_writes(conn):
+    """Swap the ar_normalize() FTS triggers for FTS_QUEUE_TRIGGERS
+
+    Triggers set aside by an interrupted catalog.py --defer import are
+    updated in deferred_schema instead, for catalog.py reindex to create.
+    """
+    for name, sql in FTS_QUEUE_TRIGGERS.items():
+        deferred = conn.execute('UPDATE deferred_schema SET sql = ? WHERE name = ?', (sql, name))
+        if not deferred.rowcount:
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute(sql)
+
+
+# (version, name, steps) -- a step is an SQL statement or a callable(conn).
+# Never edit an applied migration; append a new one instead.
+MIGRATIONS = [
+    (1, 'initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            image_url TEXT,
+            featured BOOLEAN DEFAULT 0,
+            in_stock BOOLEAN DEFAULT 1,
+            stock_quantity INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER DEFAULT 1,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS wishlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+            UNIQUE(user_id, product_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total_price REAL NOT NULL,
+            status TEXT DEFAULT 'قيد الانتظار',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(id),
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        )
+        ''',
+        _add_users_created_at,
+    ]),
+    (2, 'products full-text index', [
+        # name/description hold ar_normalize()d text; the original rows
+        # stay in products and are joined back on rowid = products.id
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, category UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description, category)
+            VALUES (new.id, ar_normalize(new.name), ar_normalize(new.description), new.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update
+        AFTER UPDATE OF name, description, category ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, name, description, category)
+            VALUES (new.id, ar_normalize(new.name), ar_normalize(new.description), new.category);
+        END
+        ''',
+        'DELETE FROM products_fts',
+        '''
+        INSERT INTO products_fts (rowid, name, description, category)
+        SELECT id, ar_normalize(name), ar_normalize(description), category FROM products
+        ''',
+    ]),
+    (3, 'listing indexes', [
+        # Each keyset page is a range scan on one of these; the implicit
+        # rowid at the end of every index is the (.., id) tie-breaker
+        'CREATE INDEX IF NOT EXISTS idx_products_created ON products (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category_created ON products (category, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category_name ON products (category, name)',
+        'CREATE INDEX IF NOT EXISTS idx_products_featured_created ON products (featured, created_at)',
+        # Weight name matches over description matches in ORDER BY rank
+        "INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    ]),
+    (4, 'order history indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+    ]),
+    (5, 'catalog version counter', [
+        '''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 0)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_version_insert AFTER INSERT ON products BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_version_delete AFTER DELETE ON products BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        # stock_quantity is left out on purpose: checkouts change it all
+        # the time and listings only show in_stock
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_version_update
+        AFTER UPDATE OF name, description, price, category, image_url,
+                        featured, in_stock, created_at ON products BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+    ]),
+    (6, 'one cart row per user and product', [
+        # Merge duplicates left by the old SELECT-then-INSERT add_to_cart
+        '''
+        UPDATE cart_items SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart_items c2
+            WHERE c2.user_id = cart_items.user_id AND c2.product_id = cart_items.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+        ''',
+        '''
+        DELETE FROM cart_items WHERE id NOT IN (
+            SELECT MIN(id) FROM cart_items GROUP BY user_id, product_id
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_items_user_product ON cart_items (user_id, product_id)',
+    ]),
+    (7, 'image derivative queue', [
+        # Images waiting for resized WebP/AVIF variants (python images.py)
+        '''
+        CREATE TABLE IF NOT EXISTS image_jobs (
+            image_url TEXT PRIMARY KEY,
+            queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_image_insert
+        AFTER INSERT ON products WHEN new.image_url IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO image_jobs (image_url) VALUES (new.image_url);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_image_update
+        AFTER UPDATE OF image_url ON products
+        WHEN new.image_url IS NOT NULL AND new.image_url IS NOT old.image_url BEGIN
+            INSERT OR IGNORE INTO image_jobs (image_url) VALUES (new.image_url);
+        END
+        ''',
+        'INSERT OR IGNORE INTO image_jobs (image_url) SELECT DISTINCT image_url FROM products WHERE image_url IS NOT NULL',
+    ]),
+    (8, 'per-user cart/wishlist version', [
+        # Bumped by every cart or wishlist change (including checkout
+        # emptying the cart); /cart/count and /wishlist derive ETags from it
+        '''
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        ''',
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_state_{event.lower()}
+        AFTER {event} ON {table} BEGIN
+            INSERT INTO user_state (user_id, version) VALUES ({row}.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        '''
+        for table in ('cart_items', 'wishlist')
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+    ]),
+    (9, 'wishlist page index', [
+        'CREATE INDEX IF NOT EXISTS idx_wishlist_user_added ON wishlist (user_id, added_at, product_id)',
+    ]),
+    (10, 'product SKUs for catalog import', [
+        _add_products_sku,
+        # NULLs don't collide, so products without a SKU are unaffected
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku)',
+        # Index/trigger DDL set aside by catalog.py during a bulk import,
+        # so an interrupted import can still be repaired (catalog.py reindex)
+        '''
+        CREATE TABLE IF NOT EXISTS deferred_schema (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (11, 'user activity for retention', [
+        _add_users_last_login,
+        # purge_users.py --inactive-days filters and counts on this
+        # expression; users who never logged in count from sign-up
+        'CREATE INDEX IF NOT EXISTS idx_users_activity ON users (COALESCE(last_login_at, created_at))',
+    ]),
+    (12, 'sales rollups', [
+        # Kept up to date by checkout and cancellation (database.py
+        # _record_sales) and rebuilt per day by python analytics.py backfill.
+        # Cancelled orders are taken out of every figure but counted.
+        '''
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cancelled_orders INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sales_product_daily (
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sales_category_daily (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID
+        ''',
+        # The backfill reads one day of orders at a time
+        'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)',
+    ]),
+    (13, 'bought-together recommendations', [
+        # Written by python recommendations.py build as a new `build`;
+        # workers serve the build named in recommendation_meta
+        '''
+        CREATE TABLE IF NOT EXISTS product_neighbors (
+            build INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (build, product_id, rank)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS recommendation_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            build INTEGER NOT NULL DEFAULT 0,
+            built_at TIMESTAMP
+        )
+        ''',
+        'INSERT OR IGNORE INTO recommendation_meta (id, build) VALUES (1, 0)',
+    ]),
+    (14, 'state triggers only for existing users', [
+        # Removing rows of a deleted user (purge_users.py orphans) must not
+        # re-create user_state for them (a FOREIGN KEY error), and anonymous
+        # cart rows (user_id NULL) have no state to bump
+    ] + [
+        f'DROP TRIGGER IF EXISTS {table}_state_{event.lower()}'
+        for table in ('cart_items', 'wishlist')
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ] + [
+        f'''
+        CREATE TRIGGER {table}_state_{event.lower()}
+        AFTER {event} ON {table}
+        WHEN EXISTS (SELECT 1 FROM users WHERE id = {row}.user_id) BEGIN
+            INSERT INTO user_state (user_id, version) VALUES ({row}.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        '''
+        for table in ('cart_items', 'wishlist')
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+    ]),
+    (15, 'search index without SQL functions', [
+        # The version 2 triggers called ar_normalize(), which exists only on
+        # the app's own connections, so writing a product from the sqlite3
+        # CLI failed. Changed rows are queued here instead and indexed
+        # before the next search (database.index_pending_products)
+        '''
+        CREATE TABLE IF NOT EXISTS products_fts_pending (
+            product_id INTEGER PRIMARY KEY
+        )
+        ''',
+        _queue_fts_writes,
+    ]),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(conn):
+    """Cheap read of the schema version stored in the database header"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _begin_immediate(conn):
+    """Take SQLite's write lock, waiting for any other migrating process"""
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+    while True:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def migrate():
+    """Apply pending migrations once, under the database write lock
+
+    Safe to call from several processes at the same time: the first one
+    takes the lock and migrates, the others wait and then find nothing
+    left to do. Returns the list of versions applied by this call.
+    """
+    conn = get_db_connection()
+    applied = []
+    try:
+        _begin_immediate(conn)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        done = {row['version'] for row in
+                conn.execute('SELECT version FROM schema_migrations')}
+        for version, name, steps in MIGRATIONS:
+            if version in done:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+                         (version, name))
+            applied.append(version)
+        conn.execute(f'PRAGMA user_version = {latest_version()}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return applied
+
+
+def ensure_schema():
+    """Worker start-up check: no writes unless the schema is behind"""
+    conn = get_db_connection()
+    try:
+        version = get_schema_version(conn)
+    finally:
+        conn.close()
+    if version < latest_version():
+        migrate()
+
+
+if __name__ == '__main__':
+    applied = migrate()
+    if applied:
+        print(f"تم تطبيق الترحيلات: {', '.join(map(str, applied))}")
+    else:
+        print("قاعدة البيانات محدثة بالفعل.")
+    print(f"إصدار المخطط: {latest_version()}")
@@ -0,0 +1,177 @@
+import functools
+import hashlib
+import os
+import time
+from flask import request, session, make_response
+from flask_login import current_user
+from cache import TTLCache
+from database import catalog_cache
+from instrumentation import register_stats
+
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))
+# Optional directory shared by all gunicorn workers on the host
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+# Oldest files beyond this many are deleted (checked every PRUNE_EVERY writes)
+PAGE_CACHE_MAX_FILES = int(os.environ.get('PAGE_CACHE_MAX_FILES', 5000))
+PRUNE_EVERY = 100
+
+
+class PageCache:
+    """Rendered HTML of anonymous pages, tagged with the catalog version
+
+    Entries live in a per-worker LRU and, when `directory` is set, in
+    files named after the catalog version and key so every worker can
+    reuse a page another one rendered. A product write bumps the version,
+    which makes every older entry a miss. The directory is capped at
+    `max_files` files, oldest first.
+    """
+
+    def __init__(self, max_size=256, ttl=300.0, directory=None, max_files=5000):
+        self.memory = TTLCache(max_size, ttl)
+        self.ttl = ttl
+        self.directory = directory
+        self.max_files = max_files
+        self.disk_hits = 0
+        self.not_modified = 0
+        self._pruned_version = None
+        self._writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, version, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, f'{version}-{digest}.html')
+
+    def get(self, version, key):
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+        if not self.directory:
+            return None
+        path = self._path(version, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        self.disk_hits += 1
+        etag = _etag(body)
+        self.memory.set(key, (version, body, etag))
+        return body, etag
+
+    def set(self, version, key, body):
+        etag = _etag(body)
+        self.memory.set(key, (version, body, etag))
+        if self.directory:
+            path = self._path(version, key)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+            self._prune(version)
+        return etag
+
+    def _prune(self, version):
+        # Drop files left from older catalog versions (once per version per
+        # worker), and the oldest ones once there are too many
+        self._writes += 1
+        if self._pruned_version != version:
+            self._pruned_version = version
+            prefix = f'{version}-'
+            self._remove(name for name in os.listdir(self.directory)
+                         if not name.startswith(prefix))
+        elif self._writes % PRUNE_EVERY == 0:
+            names = os.listdir(self.directory)
+            if len(names) > self.max_files:
+                def mtime(name):
+                    try:
+                        return os.path.getmtime(os.path.join(self.directory, name))
+                    except OSError:
+                        return 0
+                names.sort(key=mtime)
+                # Down to 90%, so this doesn't run again on the next check
+                self._remove(names[:len(names) - self.max_files * 9 // 10])
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        stats['not_modified'] = self.not_modified
+        return stats
+
+
+def _etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+page_cache = PageCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL, PAGE_CACHE_DIR, PAGE_CACHE_MAX_FILES)
+register_stats('page_cache', page_cache.stats)
+
+
+def _cache_key(query_args):
+    # Only the arguments the view reads, so ?utm_source= and other junk
+    # share the page; blank filters (?category=) render the same as none
+    args = tuple((name, request.args.get(name)) for name in query_args
+                 if request.args.get(name))
+    return (request.endpoint, args)
+
+
+def _cacheable_request():
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # The navbar and flashed messages are per visitor
+    if '_flashes' in session:
+        return False
+    return not current_user.is_authenticated
+
+
+def _respond(body, etag):
+    response = make_response(body)
+    response.set_etag(etag)
+    # Browsers must revalidate: the same URL renders differently once logged in
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        page_cache.not_modified += 1
+    return response
+
+
+def cached_page(*query_args):
+    """Serve anonymous GETs of the view from the page cache, with ETag/304
+
+    `query_args` names every request argument the view reads; all others
+    are ignored when looking the page up.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _cacheable_request():
+                return view(*args, **kwargs)
+
+            version = catalog_cache.check_version()
+            key = (_cache_key(query_args), tuple(sorted(kwargs.items())))
+            hit = page_cache.get(version, key)
+            if hit is not None:
+                return _respond(*hit)
+
+            response = make_response(view(*args, **kwargs))
+            if (response.status_code != 200 or response.mimetype != 'text/html'
+                    or '_flashes' in session or catalog_cache.version != version):
+                return response
+            body = response.get_data()
+            return _respond(body, page_cache.set(version, key, body))
+        return wrapper
+    return decorator
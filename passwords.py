@@ -0,0 +1,147 @@
+"""Password hashing off the request thread
+
+Hashing and checking passwords is deliberately slow, so it runs in a small
+process pool (PASSWORD_HASH_WORKERS processes per app worker, at lowered
+CPU priority) instead of on the request thread. At most PASSWORD_HASH_QUEUE
+hashes may be queued or running per app worker; past that, and when a hash
+takes longer than PASSWORD_HASH_TIMEOUT, HashingOverloaded is raised and
+the route answers 429 instead of piling up more work.
+
+Keep PASSWORD_HASH_QUEUE below the worker's thread count (gunicorn
+--threads) so a login flood can't occupy every thread. Set
+PASSWORD_HASH_WORKERS=0 to hash inline (tests, scripts); scripts that do
+use the pool need an `if __name__ == '__main__'` guard, as with any
+spawned process pool.
+"""
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from instrumentation import register_stats
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 2))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+PASSWORD_HASH_NICE = int(os.environ.get('PASSWORD_HASH_NICE', 10))
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _method_prefix(method):
+    """'scrypt' -> 'scrypt:32768:8:1': the parameters a new hash would get"""
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored_hash, password, method):
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] == _method_prefix(method):
+        return True, None
+    return True, generate_password_hash(password, method=method)
+
+
+def _init_worker(nice):
+    # Catalog requests get the CPU first when logins and pages compete
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_in_flight = 0
+_stats = {'completed': 0, 'rejected': 0, 'timeouts': 0}
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        # A pool inherited through fork (gunicorn --preload) has no workers
+        if _executor is None or _executor_pid != os.getpid():
+            # spawn, not fork: the app process has threads and open sockets
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(PASSWORD_HASH_NICE,))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _release(future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+        _stats['completed'] += 1
+
+
+def _run(fn, *args):
+    global _in_flight
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    with _lock:
+        if _in_flight >= PASSWORD_HASH_QUEUE:
+            _stats['rejected'] += 1
+            raise HashingOverloaded()
+        _in_flight += 1
+    try:
+        future = _get_executor().submit(fn, *args)
+    except (BrokenProcessPool, RuntimeError):
+        _release(None)
+        _reset_executor()
+        raise HashingOverloaded()
+    # The slot is freed when the hash finishes, even if we stop waiting
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        with _lock:
+            _stats['timeouts'] += 1
+        raise HashingOverloaded()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise HashingOverloaded()
+
+
+def hash_password(password):
+    """New hash for `password` (raises HashingOverloaded)"""
+    return _run(_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored_hash, password):
+    """Check a password; returns (ok, new_hash)
+
+    new_hash is set when the password is right but `stored_hash` was made
+    with other parameters than PASSWORD_HASH_METHOD's current ones; the
+    caller should store it. Raises HashingOverloaded.
+    """
+    if not stored_hash:
+        return False, None
+    return _run(_verify, stored_hash, password, PASSWORD_HASH_METHOD)
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, in_flight=_in_flight, workers=PASSWORD_HASH_WORKERS,
+                    queue_limit=PASSWORD_HASH_QUEUE)
+
+
+register_stats('password_hashing', get_stats)
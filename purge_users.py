@@ -0,0 +1,206 @@
+"""Delete users (and everything that belongs to them) in small batches
+
+    python purge_users.py --inactive-days 365 --no-orders --dry-run
+    python purge_users.py --inactive-days 730
+    python purge_users.py --all                 # every account
+    python purge_users.py orphans               # rows left by older deletes
+
+Users are picked in id order, CHUNK_SIZE at a time, and each chunk is
+deleted children-first (order items, orders, cart, wishlist, state, the
+user) in its own short write transaction, with a pause between chunks so
+checkouts and logins keep getting the lock. --dry-run only counts, from
+the indexes.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from database import get_db_connection, run_write_transaction
+from migrations import migrate
+
+CHUNK_SIZE = 500
+PAUSE = 0.05
+
+# Children first: orders and cart rows don't cascade on their own.
+# {ids} is a subquery or placeholder list of the user ids being removed.
+CASCADE = [
+    ('order_items', 'order_id IN (SELECT id FROM orders WHERE user_id IN ({ids}))'),
+    ('orders', 'user_id IN ({ids})'),
+    ('cart_items', 'user_id IN ({ids})'),
+    ('wishlist', 'user_id IN ({ids})'),
+    # After cart/wishlist: deleting those rows bumps (re-creates) the state row
+    ('user_state', 'user_id IN ({ids})'),
+    ('users', 'id IN ({ids})'),
+]
+
+# Rows whose owner is already gone (delete_users.py used to leave these)
+ORPHANS = [
+    ('order_items', '''NOT EXISTS (SELECT 1 FROM orders o JOIN users u ON u.id = o.user_id
+                                   WHERE o.id = order_items.order_id)'''),
+    ('orders', 'NOT EXISTS (SELECT 1 FROM users u WHERE u.id = orders.user_id)'),
+    ('cart_items', '''user_id IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM users u WHERE u.id = cart_items.user_id)'''),
+    ('wishlist', 'NOT EXISTS (SELECT 1 FROM users u WHERE u.id = wishlist.user_id)'),
+    ('user_state', 'NOT EXISTS (SELECT 1 FROM users u WHERE u.id = user_state.user_id)'),
+]
+
+
+def user_filter(inactive_since=None, no_orders=False):
+    """SQL condition on users `u` (and its parameters) for the given filters"""
+    conditions, params = [], []
+    if inactive_since is not None:
+        conditions.append('COALESCE(u.last_login_at, u.created_at) < ?')
+        params.append(inactive_since)
+    if no_orders:
+        conditions.append('NOT EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.id)')
+    return ' AND '.join(conditions) or '1', params
+
+
+def count(condition, params):
+    """Rows a purge would delete, per table
+
+    Users are found through idx_users_activity and every dependent table
+    is counted from its user_id/order_id index, without reading its rows.
+    """
+    ids = f'SELECT u.id FROM users u WHERE {condition}'
+    conn = get_db_connection()
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where.format(ids=ids)}',
+                                  params).fetchone()[0]
+              for table, where in CASCADE}
+    conn.close()
+    return counts
+
+
+def _run_chunks(next_chunk, delete_chunk, chunk_size, pause, progress):
+    """Shared batch loop: timing, lock hold and rows/sec bookkeeping"""
+    stats = {'rows': {}, 'batches': 0, 'max_lock_ms': 0.0}
+    started = time.perf_counter()
+    last_id = 0
+    while True:
+        chunk = next_chunk(last_id, chunk_size)
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        locked = []
+
+        def work(conn):
+            locked.append(time.perf_counter())
+            return delete_chunk(conn, chunk)
+
+        deleted = run_write_transaction(work)
+        stats['max_lock_ms'] = max(stats['max_lock_ms'], (time.perf_counter() - locked[-1]) * 1000)
+        for table, rows in deleted.items():
+            stats['rows'][table] = stats['rows'].get(table, 0) + rows
+        stats['batches'] += 1
+        if progress:
+            progress(sum(stats['rows'].values()), time.perf_counter() - started)
+        time.sleep(pause)
+
+    seconds = time.perf_counter() - started
+    total = sum(stats['rows'].values())
+    stats['max_lock_ms'] = round(stats['max_lock_ms'], 2)
+    stats['seconds'] = round(seconds, 3)
+    stats['rows_per_second'] = round(total / seconds) if seconds else None
+    return stats
+
+
+def purge_users(condition, params, chunk_size=CHUNK_SIZE, pause=PAUSE, progress=None):
+    """Delete the users matching `condition` with all their rows; returns stats"""
+    def next_chunk(last_id, limit):
+        conn = get_db_connection()
+        rows = conn.execute(f'''
+            SELECT u.id FROM users u WHERE u.id > ? AND {condition} ORDER BY u.id LIMIT ?
+        ''', [last_id] + params + [limit]).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+    def delete_chunk(conn, chunk):
+        # Re-check under the lock: a user may have logged in or ordered since
+        placeholders = ','.join('?' * len(chunk))
+        ids = [row[0] for row in conn.execute(
+            f'SELECT u.id FROM users u WHERE u.id IN ({placeholders}) AND {condition}',
+            chunk + params)]
+        if not ids:
+            return {}
+        placeholders = ','.join('?' * len(ids))
+        return {table: conn.execute(f'DELETE FROM {table} WHERE {where.format(ids=placeholders)}',
+                                    ids).rowcount
+                for table, where in CASCADE}
+
+    return _run_chunks(next_chunk, delete_chunk, chunk_size, pause, progress)
+
+
+def purge_orphans(chunk_size=CHUNK_SIZE, pause=PAUSE, progress=None):
+    """Delete rows whose user (or order) no longer exists; returns stats"""
+    totals = {'rows': {}, 'batches': 0, 'max_lock_ms': 0.0, 'seconds': 0.0}
+    for table, orphaned in ORPHANS:
+        def next_chunk(last_id, limit):
+            conn = get_db_connection()
+            rows = conn.execute(f'''
+                SELECT rowid FROM {table} WHERE rowid > ? AND {orphaned} ORDER BY rowid LIMIT ?
+            ''', (last_id, limit)).fetchall()
+            conn.close()
+            return [row[0] for row in rows]
+
+        def delete_chunk(conn, chunk):
+            placeholders = ','.join('?' * len(chunk))
+            return {table: conn.execute(
+                f'DELETE FROM {table} WHERE rowid IN ({placeholders}) AND {orphaned}',
+                chunk).rowcount}
+
+        stats = _run_chunks(next_chunk, delete_chunk, chunk_size, pause, progress)
+        totals['rows'].update(stats['rows'])
+        totals['batches'] += stats['batches']
+        totals['max_lock_ms'] = max(totals['max_lock_ms'], stats['max_lock_ms'])
+        totals['seconds'] = round(totals['seconds'] + stats['seconds'], 3)
+    total = sum(totals['rows'].values())
+    totals['rows_per_second'] = round(total / totals['seconds']) if totals['seconds'] else None
+    return totals
+
+
+def _report(rows, seconds):
+    rate = rows / seconds if seconds else 0
+    print(f'\r{rows:,} rows  {rate:,.0f} rows/s', end='', file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Delete users in small batches')
+    parser.add_argument('command', nargs='?', choices=['users', 'orphans'], default='users')
+    parser.add_argument('--inactive-days', type=int,
+                        help='no login (or sign-up, if never logged in) for this many days')
+    parser.add_argument('--inactive-since', help="same, as a date: 'YYYY-MM-DD'")
+    parser.add_argument('--no-orders', action='store_true', help='only users who never ordered')
+    parser.add_argument('--all', action='store_true', help='every user (no filter)')
+    parser.add_argument('--dry-run', action='store_true', help='only count what would be deleted')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--pause', type=float, default=PAUSE, help='seconds between chunks')
+    args = parser.parse_args(argv)
+
+    migrate()
+    if args.command == 'orphans':
+        stats = purge_orphans(args.chunk_size, args.pause, _report)
+        print(file=sys.stderr)
+        print(json.dumps(stats))
+        return 0
+
+    inactive_since = args.inactive_since
+    if args.inactive_days is not None:
+        cutoff = datetime.utcnow() - timedelta(days=args.inactive_days)
+        inactive_since = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+    if inactive_since is None and not args.no_orders and not args.all:
+        parser.error('choose a filter (--inactive-days/--inactive-since, --no-orders) or --all')
+    condition, params = user_filter(inactive_since, args.no_orders)
+
+    if args.dry_run:
+        print(json.dumps(count(condition, params)))
+        return 0
+    stats = purge_users(condition, params, args.chunk_size, args.pause, _report)
+    print(file=sys.stderr)
+    print(f"تم حذف {stats['rows'].get('users', 0)} حساب.", file=sys.stderr)
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import register_stats
+
+# Login/register attempts allowed per client IP and per username: a burst,
+# then a steady refill. Buckets live in each worker's memory, so with N
+# workers a client can get up to N times these numbers.
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 20))
+LOGIN_IP_PER_MINUTE = float(os.environ.get('LOGIN_IP_PER_MINUTE', 20))
+LOGIN_USER_BURST = int(os.environ.get('LOGIN_USER_BURST', 5))
+LOGIN_USER_PER_MINUTE = float(os.environ.get('LOGIN_USER_PER_MINUTE', 5))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+
+class TokenBucketLimiter:
+    """Thread-safe token bucket per key, for the `max_keys` most recent keys
+
+    A key that was evicted comes back with a full bucket, so max_keys
+    should comfortably exceed the number of clients active per refill.
+    """
+
+    def __init__(self, burst, per_minute, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def take(self, key):
+        """Spend a token for `key`: 0 if allowed, else seconds until one is free"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate if self.rate else 3600
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._buckets), 'burst': self.burst,
+                    'per_minute': self.rate * 60, 'allowed': self.allowed,
+                    'rejected': self.rejected}
+
+
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+login_user_limiter = TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE)
+register_stats('login_ip_limiter', login_ip_limiter.stats)
+register_stats('login_user_limiter', login_user_limiter.stats)
+
+
+def throttle_login(ip, username=None):
+    """Seconds the client must wait before this attempt, or 0 to go ahead
+
+    Checked before any database lookup or password hashing. The username
+    bucket is only spent once the IP bucket allowed the attempt.
+    """
+    wait = login_ip_limiter.take(ip)
+    if wait or username is None:
+        return wait
+    return login_user_limiter.take(username)
@@ -0,0 +1,286 @@
+"""'Bought together' recommendations
+
+    python recommendations.py build                  # needs numpy and scipy
+    python recommendations.py bench --lines 1000000  # synthetic, no database
+
+`build` counts how often two products were bought in the same order (not
+cancelled) with one sparse matrix product, keeps each product's TOP_K
+neighbours by cosine similarity and writes them to product_neighbors as a
+new build. Run it periodically (e.g. nightly from cron).
+
+Workers load the current build once, and again only after a newer build
+appears, so related products are a dictionary lookup. Products without
+neighbours are filled up from their category. Serving needs neither numpy
+nor scipy.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from cache import VersionedCache
+from database import get_db_connection, run_write_transaction, ORDER_CANCELLED
+from instrumentation import register_stats
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # only the build job needs them
+    np = sparse = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', 8))
+# Pairs bought together fewer times than this are treated as noise
+MIN_CO_ORDERS = int(os.environ.get('RECOMMENDATIONS_MIN_CO_ORDERS', 2))
+RECOMMENDATIONS_CHECK_INTERVAL = float(os.environ.get('RECOMMENDATIONS_CHECK_INTERVAL', 60))
+RELATED_LIMIT = 4
+FETCH_CHUNK = 100000
+WRITE_CHUNK = 5000
+
+
+def compute_neighbors(order_ids, product_ids, top_k=TOP_K, min_count=MIN_CO_ORDERS):
+    """Yield (product_id, neighbor_ids, scores) from parallel order-line arrays
+
+    A is the orders x products 0/1 matrix; A.T @ A counts the orders each
+    pair shares. Scores are cosine similarities (shared orders over the
+    geometric mean of both products' order counts), so best-sellers don't
+    become everyone's neighbour.
+    """
+    orders, order_idx = np.unique(order_ids, return_inverse=True)
+    products, product_idx = np.unique(product_ids, return_inverse=True)
+    basket = sparse.csr_matrix(
+        (np.ones(len(order_idx), dtype=np.int32), (order_idx, product_idx)),
+        shape=(len(orders), len(products)))
+    basket.sum_duplicates()
+    basket.data[:] = 1  # the same product twice in one order counts once
+
+    order_counts = np.asarray(basket.sum(axis=0)).ravel()
+    co_orders = (basket.T @ basket).tocsr()
+    co_orders.setdiag(0)
+    co_orders.data[co_orders.data < max(min_count, 1)] = 0
+    co_orders.eliminate_zeros()
+
+    scores = co_orders.astype(np.float32)
+    rows = np.repeat(np.arange(len(products)), np.diff(scores.indptr))
+    norms = np.sqrt(order_counts, dtype=np.float32)
+    scores.data /= norms[rows] * norms[scores.indices]
+
+    for row in np.flatnonzero(np.diff(scores.indptr)):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        data, cols = scores.data[start:end], scores.indices[start:end]
+        if end - start > top_k:
+            best = np.argpartition(-data, top_k)[:top_k]
+            data, cols = data[best], cols[best]
+        ranked = np.argsort(-data, kind='stable')
+        yield int(products[row]), products[cols[ranked]].tolist(), data[ranked].tolist()
+
+
+def load_order_lines():
+    """(order_ids, product_ids) arrays of every non-cancelled order line"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples convert to arrays much faster
+    cursor.execute('''
+        SELECT oi.order_id, oi.product_id
+        FROM order_items oi JOIN orders o ON o.id = oi.order_id
+        WHERE o.status != ?
+    ''', (ORDER_CANCELLED,))
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_CHUNK)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    conn.close()
+    lines = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    return lines[:, 0], lines[:, 1]
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KB on Linux
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _current_build():
+    conn = get_db_connection()
+    row = conn.execute('SELECT build FROM recommendation_meta WHERE id = 1').fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def _delete_builds_except(build):
+    """Drop other builds' rows a few products per transaction"""
+    conn = get_db_connection()
+    stale = conn.execute('''
+        SELECT DISTINCT build, product_id FROM product_neighbors WHERE build != ?
+    ''', (build,)).fetchall()
+    conn.close()
+    step = max(1, WRITE_CHUNK // TOP_K)
+    for i in range(0, len(stale), step):
+        chunk = [tuple(row) for row in stale[i:i + step]]
+        run_write_transaction(lambda conn: conn.executemany(
+            'DELETE FROM product_neighbors WHERE build = ? AND product_id = ?', chunk))
+
+
+def build(top_k=TOP_K, min_count=MIN_CO_ORDERS):
+    """Compute and store a new build, then make it current; returns stats"""
+    if np is None:
+        raise RuntimeError('recommendations.py build needs numpy and scipy (pip install numpy scipy)')
+    from migrations import migrate
+    migrate()
+    started = time.perf_counter()
+    tracemalloc.start()
+
+    current = _current_build()
+    _delete_builds_except(current)  # leftovers of an interrupted build
+    order_ids, product_ids = load_order_lines()
+    loaded = time.perf_counter()
+
+    new_build = current + 1
+    batch, products = [], 0
+
+    def flush(rows):
+        run_write_transaction(lambda conn: conn.executemany('''
+            INSERT INTO product_neighbors (build, product_id, rank, neighbor_id, score)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows))
+
+    for product_id, neighbor_ids, scores in compute_neighbors(order_ids, product_ids,
+                                                              top_k, min_count):
+        products += 1
+        batch.extend((new_build, product_id, rank, neighbor_id, score)
+                     for rank, (neighbor_id, score) in enumerate(zip(neighbor_ids, scores)))
+        if len(batch) >= WRITE_CHUNK:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    computed = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    run_write_transaction(lambda conn: conn.execute('''
+        UPDATE recommendation_meta SET build = ?, built_at = CURRENT_TIMESTAMP WHERE id = 1
+    ''', (new_build,)))
+    _delete_builds_except(new_build)
+    return {
+        'build': new_build,
+        'order_lines': len(order_ids),
+        'products_with_neighbors': products,
+        'load_seconds': round(loaded - started, 3),
+        'compute_and_write_seconds': round(computed - loaded, 3),
+        'seconds': round(time.perf_counter() - started, 3),
+        'peak_traced_mb': round(peak / 1e6, 1),
+        'max_rss_mb': _max_rss_mb(),
+    }
+
+
+def bench(lines, products, top_k=TOP_K, min_count=MIN_CO_ORDERS, seed_value=42):
+    """Time compute_neighbors on synthetic Zipf-like baskets (no database)"""
+    if np is None:
+        raise RuntimeError('recommendations.py bench needs numpy and scipy')
+    rng = np.random.default_rng(seed_value)
+    sizes = rng.integers(1, 6, size=lines // 3 + 1)
+    order_ids = np.repeat(np.arange(len(sizes)), sizes)[:lines]
+    popularity = 1.0 / np.arange(1, products + 1) ** 0.8
+    product_ids = rng.choice(products, size=len(order_ids), p=popularity / popularity.sum())
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    neighbors = sum(1 for _ in compute_neighbors(order_ids, product_ids, top_k, min_count))
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'order_lines': len(order_ids),
+        'products': products,
+        'products_with_neighbors': neighbors,
+        'seconds': round(seconds, 3),
+        'peak_traced_mb': round(peak / 1e6, 1),
+        'max_rss_mb': _max_rss_mb(),
+    }
+
+
+# Per-worker copy of the current build: {product_id: (neighbor ids, best first)}
+neighbor_cache = VersionedCache(_current_build, max_size=1, ttl=24 * 3600,
+                                check_interval=RECOMMENDATIONS_CHECK_INTERVAL)
+register_stats('recommendations', neighbor_cache.stats)
+
+
+@neighbor_cache.cached
+def _neighbor_table():
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT product_id, neighbor_id FROM product_neighbors
+        WHERE build = ? ORDER BY product_id, rank
+    ''', (neighbor_cache.version,))
+    table = {}
+    for product_id, neighbor_id in rows:
+        table.setdefault(product_id, []).append(neighbor_id)
+    conn.close()
+    return {product_id: tuple(ids) for product_id, ids in table.items()}
+
+
+def neighbors(product_id):
+    """Products most often bought with `product_id`, best first"""
+    return _neighbor_table().get(int(product_id), ())
+
+
+def get_related_products(product_id, category, limit=RELATED_LIMIT):
+    """In-stock products bought together with this one, then from its category"""
+    ids = list(neighbors(product_id))
+    conn = get_db_connection()
+    products = []
+    if ids:
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(f'''
+            SELECT * FROM products WHERE id IN ({placeholders}) AND in_stock = 1
+        ''', ids).fetchall()
+        by_id = {row['id']: row for row in rows}
+        products = [by_id[i] for i in ids if i in by_id][:limit]
+    if len(products) < limit:
+        exclude = [product_id] + [row['id'] for row in products]
+        placeholders = ','.join('?' * len(exclude))
+        products += conn.execute(f'''
+            SELECT * FROM products
+            WHERE category = ? AND in_stock = 1 AND id NOT IN ({placeholders})
+            ORDER BY created_at DESC, id DESC LIMIT ?
+        ''', [category] + exclude + [limit - len(products)]).fetchall()
+    conn.close()
+    return products
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="'Bought together' recommendations")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('build', 'bench'):
+        sub = commands.add_parser(name)
+        sub.add_argument('--top-k', type=int, default=TOP_K)
+        sub.add_argument('--min-count', type=int, default=MIN_CO_ORDERS,
+                         help='ignore pairs bought together fewer times')
+        if name == 'bench':
+            sub.add_argument('--lines', type=int, default=1_000_000, help='order lines')
+            sub.add_argument('--products', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'build':
+            stats = build(args.top_k, args.min_count)
+        else:
+            stats = bench(args.lines, args.products, args.top_k, args.min_count)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
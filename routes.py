@@ -1,84 +1,133 @@
-import sqlite3
-from flask import render_template, request, redirect, url_for, flash, session, jsonify
+import math
+import os
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, Response
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash
-from werkzeug.security import check_password_hash
 from app import app, User
+from instrumentation import render_metrics
+from page_cache import cached_page
+from passwords import hash_password, verify_password, HashingOverloaded
+from rate_limit import throttle_login
+import wishlist
+import analytics
+import recommendations
+import suggest
 from database import (
-    get_all_products, get_featured_products, get_product_by_id, search_products,
-    get_products_by_category, get_categories, get_related_products,
-    create_user, get_user_by_username, get_user_by_email,
-    add_to_cart, get_cart_items, get_cart_count, get_cart_total,
-    update_cart_item, remove_cart_item, clear_cart,add_to_wishlist,create_order,
-    get_wishlist_for_user, remove_from_wishlist, is_in_wishlist, cancel_order_by_id,
-    get_orders_for_user,
-    DATABASE_PATH
+    get_featured_products, get_product_by_id, get_categories,
+    create_user, get_user_by_username, get_user_by_email, record_login, update_user_password,
+    add_to_cart, get_cart_count, get_cart_summary,
+    update_cart_item, remove_cart_item, clear_cart, apply_cart_batch, create_order, cancel_order_by_id,
+    get_products_page, search_products_page,
+    get_order_history, get_user_state_version, get_user_page_state,
+    InsufficientStockError, PAGE_SIZE, ORDERS_PAGE_SIZE
 )
 
+# /cart/count and /wishlist responses fetched with the page's state token
+# (?v=) stay fresh in the browser until a cart/wishlist change moves it
+STATE_MAX_AGE = 24 * 3600
+
 @app.route('/')
+@cached_page()
 def index():
     """Homepage with hero section and featured products"""
     featured_products = get_featured_products()
     return render_template('index.html', featured_products=featured_products)
 
 @app.route('/products')
+@cached_page('category', 'search', 'sort', 'cursor', 'limit')
 def products():
     """Product listing page"""
     category = request.args.get('category', '')
     search = request.args.get('search', '')
+    sort = request.args.get('sort', 'newest')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', PAGE_SIZE)
     
     # Get products based on filters
-    if search and category:
-        filtered_products = search_products(search, category)
-    elif search:
-        filtered_products = search_products(search)
-    elif category:
-        filtered_products = get_products_by_category(category)
+    if search:
+        page = search_products_page(search, category or None, cursor, limit)
     else:
-        filtered_products = get_all_products()
+        page = get_products_page(category or None, sort, cursor, limit)
     
     categories = get_categories()
     
     return render_template('products.html', 
-                         products=filtered_products, 
+                         products=page['items'], 
+                         page=page,
                          categories=categories,
                          current_category=category,
-                         search_term=search)
+                         search_term=search,
+                         sort=sort)
 
 
 @app.route('/about')
+@cached_page()
 def about():
     """About us page"""
     return render_template('about.html')
 
 @app.route('/contact')
+@cached_page()
 def contact():
     """Contact us page"""
     return render_template('contact.html')
 
 @app.route('/search')
+@cached_page('q', 'category', 'cursor', 'limit')
 def search():
     """Enhanced search page"""
     query = request.args.get('q', '')
     category = request.args.get('category', '')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', PAGE_SIZE)
     
     if not query:
         return redirect(url_for('products'))
     
     # Search in products
-    if category:
-        results = search_products(query, category)
-    else:
-        results = search_products(query)
+    page = search_products_page(query, category or None, cursor, limit)
     
     categories = get_categories()
     
     return render_template('search_results.html', 
-                         results=results, 
+                         results=page['items'], 
+                         page=page,
                          query=query,
                          categories=categories,
                          selected_category=category)
 
+# Suggestions only change with the catalog, so browsers may reuse them briefly
+SUGGEST_MAX_AGE = 60
+
+@app.route('/search/suggest')
+def search_suggest():
+    """Products and categories starting with ?q= (search-as-you-type), as JSON
+
+    Served from this worker's in-memory prefix index (suggest.py).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', suggest.SUGGEST_LIMIT)), 1),
+                    suggest.SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = suggest.SUGGEST_LIMIT
+    query = request.args.get('q', '')[:100]
+    response = jsonify(dict(suggest.suggest(query, limit), query=query))
+    response.headers['Cache-Control'] = f'public, max-age={SUGGEST_MAX_AGE}'
+    return response
+
+def too_many_requests(template, message, retry_after):
+    """429 that re-renders a form with a flash message and Retry-After"""
+    flash(message, 'error')
+    response = app.make_response((render_template(template), 429))
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def throttled(template, wait):
+    return too_many_requests(
+        template, f'محاولات كثيرة، يرجى المحاولة مرة أخرى بعد {math.ceil(wait)} ثانية', wait)
+
+def hashing_busy(template):
+    return too_many_requests(template, 'الخادم مشغول حالياً، يرجى المحاولة بعد لحظات', 1)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """User login page"""
@@ -89,15 +138,26 @@ def login():
         username = request.form['username']
         password = request.form['password']
         remember = 'remember' in request.form
+
+        # Before any lookup or hashing, so a flood costs almost nothing
+        wait = throttle_login(request.remote_addr, username)
+        if wait:
+            return throttled('login.html', wait)
         
         user_data = get_user_by_username(username)
-        print(user_data)
-
         
         if user_data:
             user = User(user_data)
-            if user.check_password(password):
+            try:
+                valid, new_hash = verify_password(user.password_hash, password)
+            except HashingOverloaded:
+                return hashing_busy('login.html')
+            if valid:
+                if new_hash:
+                    # Stored with older hash parameters; upgrade it now
+                    update_user_password(user.id, new_hash)
                 login_user(user, remember=remember)
+                record_login(user.id)
                 next_page = request.args.get('next')
                 flash(f'مرحباً بك {user.first_name or user.username}!', 'success')
                 return redirect(next_page) if next_page else redirect(url_for('index'))
@@ -120,6 +180,10 @@ def register():
         first_name = request.form.get('first_name', '')
         last_name = request.form.get('last_name', '')
         phone = request.form.get('phone', '')
+
+        wait = throttle_login(request.remote_addr)
+        if wait:
+            return throttled('register.html', wait)
         
         # Validation
         if password != confirm_password:
@@ -140,7 +204,10 @@ def register():
             return render_template('register.html')
         
         # Create new user
-        password_hash = generate_password_hash(password)
+        try:
+            password_hash = hash_password(password)
+        except HashingOverloaded:
+            return hashing_busy('register.html')
         user_id = create_user(username, email, password_hash, first_name, last_name, phone)
         
         if user_id:
@@ -162,8 +229,9 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    orders = get_orders_for_user(current_user.id)
-    return render_template('profile.html', orders=orders)
+    page = get_order_history(int(current_user.id), request.args.get('cursor'),
+                             request.args.get('limit', ORDERS_PAGE_SIZE))
+    return render_template('profile.html', orders=page['items'], page=page)
 
 # إلغاء طلب
 @app.route('/orders/cancel', methods=['POST'])
@@ -183,21 +251,15 @@ def cancel_order():
 @app.route('/cart')
 def cart():
     """Shopping cart page"""
-    cart_items = []
-    cart_total = 0
-    cart_count = 0
-    
-    if current_user.is_authenticated:
-        cart_items = get_cart_items(int(current_user.id))
-        cart_total = get_cart_total(int(current_user.id))
-        cart_count = get_cart_count(int(current_user.id))
-    
     cart_data = {
-        'items': cart_items,
-        'total_price': cart_total,
-        'total_items': cart_count
+        'items': [],
+        'total_price': 0,
+        'total_items': 0
     }
     
+    if current_user.is_authenticated:
+        cart_data = get_cart_summary(int(current_user.id))
+    
     return render_template('cart.html', cart=cart_data)
 
 @app.route('/cart/add', methods=['POST'])
@@ -208,17 +270,16 @@ def add_to_cart_route():
         data = request.get_json()
         product_id = data.get('product_id')
         quantity = data.get('quantity', 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return jsonify({'success': False, 'message': 'الكمية غير صالحة'}), 400
         
-        product = get_product_by_id(product_id)
-        if not product:
-            return jsonify({'success': False, 'message': 'المنتج غير موجود'})
-        
-        if not product['in_stock']:
+        cart_count = add_to_cart(int(current_user.id), product_id, quantity)
+        if cart_count is None:
+            # Rare path: only now find out why the add was rejected
+            if not get_product_by_id(product_id):
+                return jsonify({'success': False, 'message': 'المنتج غير موجود'})
             return jsonify({'success': False, 'message': 'المنتج غير متوفر'})
         
-        add_to_cart(int(current_user.id), product_id, quantity)
-        cart_count = get_cart_count(int(current_user.id))
-        
         return jsonify({
             'success': True, 
             'message': 'تم إضافة المنتج للسلة',
@@ -237,9 +298,9 @@ def update_cart_route():
         item_id = data.get('item_id')
         quantity = data.get('quantity')
         
-        update_cart_item(item_id, quantity, int(current_user.id))
+        cart_count = update_cart_item(item_id, quantity, int(current_user.id))
         
-        return jsonify({'success': True, 'message': 'تم تحديث الكمية'})
+        return jsonify({'success': True, 'message': 'تم تحديث الكمية', 'cart_count': cart_count})
         
     except Exception as e:
         return jsonify({'success': False, 'message': 'حدث خطأ في التحديث'})
@@ -252,9 +313,9 @@ def remove_from_cart_route():
         data = request.get_json()
         item_id = data.get('item_id')
         
-        remove_cart_item(item_id, int(current_user.id))
+        cart_count = remove_cart_item(item_id, int(current_user.id))
         
-        return jsonify({'success': True, 'message': 'تم حذف المنتج'})
+        return jsonify({'success': True, 'message': 'تم حذف المنتج', 'cart_count': cart_count})
         
     except Exception as e:
         return jsonify({'success': False, 'message': 'حدث خطأ في الحذف'})
@@ -266,70 +327,165 @@ def clear_cart_route():
     try:
         clear_cart(int(current_user.id))
         
-        return jsonify({'success': True, 'message': 'تم إفراغ السلة'})
+        return jsonify({'success': True, 'message': 'تم إفراغ السلة', 'cart_count': 0})
         
     except Exception as e:
         return jsonify({'success': False, 'message': 'حدث خطأ في إفراغ السلة'})
 
+@app.route('/cart/batch', methods=['POST'])
+@login_required
+def cart_batch_route():
+    """Apply several cart edits in one transaction (see main.js queueCartOperation)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        batch = apply_cart_batch(int(current_user.id), data.get('operations'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': 'طلب غير صالح', 'error': str(e)}), 400
+
+    summary = batch['summary']
+    return jsonify({
+        'success': True,
+        'results': batch['results'],
+        'cart_count': summary['total_items'],
+        'total_price': summary['total_price'],
+        'items': [{
+            'id': item['id'],
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'total_price': item['total_price'],
+        } for item in summary['items']],
+    })
+
+@app.template_global()
+def page_state():
+    """Data island for logged-in pages (base.html): cart badge, wishlist
+    hearts and display name without any request from main.js"""
+    user_id = int(current_user.id)
+    state = get_user_page_state(user_id)
+    return {
+        'state_version': f"{user_id}.{state['version']}",
+        'cart_count': state['cart_count'],
+        'wishlist': state['wishlist'],
+        'display_name': current_user.first_name or current_user.username,
+    }
+
+def user_state_response(name, load):
+    """JSON built from the user's cart/wishlist, revalidated by state version
+
+    The ETag comes from the user's state version, so If-None-Match is
+    answered with a 304 before `load` touches the cart or wishlist.
+    Requests carrying the page's current token (?v=, see base.html) may
+    be served from the browser cache without a round trip.
+    """
+    user_id = int(current_user.id)
+    version = get_user_state_version(user_id)
+    token = f'{user_id}.{version}'
+    etag = f'{name}-{token}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(load(user_id, version))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if request.args.get('v') == token:
+        response.cache_control.max_age = STATE_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
 @app.route('/cart/count')
 def cart_count_route():
     """Get cart items count"""
-    count = 0
-    if current_user.is_authenticated:
-        count = get_cart_count(int(current_user.id))
-    return jsonify({'count': count})
+    if not current_user.is_authenticated:
+        return jsonify({'count': 0})
+    return user_state_response('cart-count', lambda user_id, version: {
+        'count': get_cart_count(user_id)})
 
 @app.route('/wishlist/page')
 @login_required
 def wishlist_page():
-    user_id = current_user.id
-    wishlist_ids = get_wishlist_for_user(user_id)
-    
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    if wishlist_ids:
-        placeholders = ','.join(['?']*len(wishlist_ids))
-        cursor.execute(f"SELECT * FROM products WHERE id IN ({placeholders})", wishlist_ids)
-        products = cursor.fetchall()
-    else:
-        products = []
-
-    conn.close()
-    return render_template('wishlist_page.html', products=products)
+    page = wishlist.get_wishlist_page(int(current_user.id), request.args.get('cursor'),
+                                      request.args.get('limit', PAGE_SIZE))
+    return render_template('wishlist_page.html', products=page['items'], page=page)
 
 
 @app.route('/wishlist/toggle', methods=['POST'])
 @login_required
 def toggle_wishlist():
-    data = request.get_json()
-    product_id = data.get('product_id')
-    user_id = current_user.id
+    data = request.get_json(silent=True) or {}
+    try:
+        product_id = int(data.get('product_id'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'منتج غير صالح'}), 400
 
-    if is_in_wishlist(user_id, product_id):
-        remove_from_wishlist(user_id, product_id)
-        return jsonify({'success': True, 'message': 'تم حذف المنتج من المفضلة'})
-    else:
-        add_to_wishlist(user_id, product_id)
-        return jsonify({'success': True, 'message': 'تم إضافة المنتج للمفضلة'})
+    in_wishlist = wishlist.toggle(int(current_user.id), product_id)
+    if in_wishlist is None:
+        return jsonify({'success': False, 'message': 'المنتج غير موجود'}), 404
+    if in_wishlist:
+        return jsonify({'success': True, 'in_wishlist': True, 'message': 'تم إضافة المنتج للمفضلة'})
+    return jsonify({'success': True, 'in_wishlist': False, 'message': 'تم حذف المنتج من المفضلة'})
 
 @app.route('/wishlist')
 @login_required
 def get_wishlist():
-
-    user_id = current_user.id
-    
-    wishlist = get_wishlist_for_user(user_id)  # ترجع قائمة product_id
-    return jsonify({"success": True, "wishlist": wishlist})
+    # ترجع قائمة product_id
+    return user_state_response('wishlist', lambda user_id, version: {
+        "success": True, "wishlist": sorted(wishlist.product_ids(user_id, version))})
 @app.route('/checkout', methods=['POST'])
 @login_required
 def checkout():
-    order_id = create_order(current_user.id)
+    try:
+        order_id = create_order(int(current_user.id))
+    except InsufficientStockError as e:
+        return jsonify({'success': False,
+                        'message': f'الكمية المطلوبة غير متوفرة: {", ".join(e.products)}'})
     if order_id:
         return jsonify({'success': True, 'message': f'تم إنشاء الطلب بنجاح!'})
     return jsonify({'success': False, 'message': 'السلة فارغة'})
 
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus metrics of this worker
+
+    Not served unless METRICS_TOKEN is set; send it as a bearer token.
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/analytics/sales')
+def sales_analytics():
+    """Sales totals, daily figures, top products and categories as JSON
+
+    ?from=&to= (ISO dates, default the last 30 days), ?limit= top products.
+    Reads only the rollup tables. Disabled unless ANALYTICS_TOKEN is set;
+    send it as a bearer token.
+    """
+    token = os.environ.get('ANALYTICS_TOKEN')
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    try:
+        start, end = analytics.report_range(request.args.get('from'), request.args.get('to'))
+        limit = min(max(int(request.args.get('limit', analytics.TOP_LIMIT)), 1), 100)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(analytics.get_sales_report(start, end, limit))
+
+@app.route('/products/<int:product_id>/related')
+def related_products(product_id):
+    """Products often bought with this one (see recommendations.py), as JSON"""
+    product = get_product_by_id(product_id)
+    if not product:
+        return jsonify({'success': False, 'message': 'المنتج غير موجود'}), 404
+    related = recommendations.get_related_products(product_id, product['category'])
+    return jsonify({'success': True, 'products': [
+        {key: row[key] for key in ('id', 'name', 'price', 'category', 'image_url')}
+        for row in related]})
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors"""
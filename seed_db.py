@@ -0,0 +1,53 @@
+from database import get_db_connection, refresh_search_index
+from migrations import migrate
+from images import process_pending
+
+SAMPLE_PRODUCTS = [
+    ('هاتف ذكي متطور', 'هاتف ذكي بمواصفات عالية وتقنيات حديثة', 2500, 'إلكترونيات',
+     'uploads/تلفون.jpg', 1, 1, 10),
+
+    ('لابتوب للألعاب', 'لابتوب قوي مخصص للألعاب والتصميم', 4500, 'إلكترونيات',
+     'uploads/لاب.avif', 1, 1, 5),
+
+    ('ساعة ذكية', 'ساعة ذكية لتتبع اللياقة البدنية', 800, 'إكسسوارات',
+     'uploads/ساعة.avif', 1, 1, 15),
+
+    ('سماعات لاسلكية', 'سماعات بلوتوث عالية الجودة', 350, 'إكسسوارات',
+     'uploads/سماعة.jpeg', 0, 1, 20),
+
+    ('كاميرا رقمية', 'كاميرا احترافية للتصوير', 3200, 'إلكترونيات',
+     'uploads/كاميرا.jpg', 1, 1, 8),
+
+    ('جهاز لوحي', 'جهاز لوحي للعمل والترفيه', 1800, 'إلكترونيات',
+     'uploads/جهاز لوخي.avif', 1, 0, 0)
+]
+
+
+def seed_products():
+    """Insert the sample products that are not already in the catalog
+
+    Idempotent: products are matched by name, so running it again adds
+    nothing and never changes the IDs of existing rows.
+    """
+    migrate()
+    conn = get_db_connection()
+    # rowcount, unlike total_changes, leaves out rows written by triggers
+    cursor = conn.executemany('''
+        INSERT INTO products (name, description, price, category, image_url, featured, in_stock, stock_quantity)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM products WHERE name = ?1)
+    ''', SAMPLE_PRODUCTS)
+    inserted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    refresh_search_index()
+    return inserted
+
+
+if __name__ == "__main__":
+    count = seed_products()
+    print(f"تمت إضافة {count} منتج.")
+    # Resized WebP/AVIF variants of the product images (needs Pillow)
+    images = process_pending()
+    if images:
+        print(f"تمت معالجة {images} صورة.")
@@ -19,10 +19,8 @@ def show_all_tables_and_data():
         columns = [col[1] for col in c.fetchall()]
         print("الأعمدة:", columns)
 
-        # جلب البيانات
-        c.execute(f"SELECT * FROM {table}")
-        rows = c.fetchall()
-        for row in rows:
+        # جلب البيانات (صف بصف بدل fetchall حتى مع الجداول الكبيرة)
+        for row in conn.execute(f"SELECT * FROM {table}"):
             print(row)
 
     conn.close()
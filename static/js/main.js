@@ -195,7 +195,7 @@ function addToCart(productId, quantity = 1) {
     .then(data => {
         if (data.success) {
             showNotification(data.message, 'success');
-            updateCartDisplay();
+            setCartBadge(data.cart_count);
         } else {
             showNotification(data.message || 'حدث خطأ', 'error');
         }
@@ -213,15 +213,88 @@ function addToCart(productId, quantity = 1) {
     });
 }
 
-function updateCartDisplay() {
-    fetch('/cart/count')
+// Cart mutations return the new count, so the badge needs no extra request
+function setCartBadge(count) {
+    const cartBadge = document.getElementById('cartBadge');
+    if (cartBadge) {
+        cartBadge.textContent = count;
+        cartBadge.style.display = count > 0 ? 'inline' : 'none';
+    }
+}
+
+// Cart edits made in quick succession go to /cart/batch as one request (and
+// one transaction): the latest update/remove of an item replaces earlier
+// ones, repeated adds of a product are summed
+const CART_BATCH_DELAY = 400;
+const cartBatch = { operations: new Map(), callbacks: [], timer: null };
+
+function queueCartOperation(operation, onDone) {
+    const key = operation.op === 'add' ? `product-${operation.product_id}` : `item-${operation.item_id}`;
+    const pending = cartBatch.operations.get(key);
+    if (operation.op === 'add' && pending) {
+        operation = { ...operation, quantity: (pending.quantity || 1) + (operation.quantity || 1) };
+    }
+    cartBatch.operations.set(key, operation);
+    if (onDone) cartBatch.callbacks.push(onDone);
+
+    clearTimeout(cartBatch.timer);
+    cartBatch.timer = setTimeout(flushCartBatch, CART_BATCH_DELAY);
+}
+
+function takeCartBatch() {
+    const batch = { operations: Array.from(cartBatch.operations.values()), callbacks: cartBatch.callbacks };
+    clearTimeout(cartBatch.timer);
+    cartBatch.operations = new Map();
+    cartBatch.callbacks = [];
+    cartBatch.timer = null;
+    return batch;
+}
+
+function flushCartBatch() {
+    const batch = takeCartBatch();
+    if (!batch.operations.length) return;
+
+    fetch('/cart/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ operations: batch.operations })
+    })
     .then(response => response.json())
     .then(data => {
-        const cartBadge = document.getElementById('cartBadge');
-        if (cartBadge) {
-            cartBadge.textContent = data.count;
-            cartBadge.style.display = data.count > 0 ? 'inline' : 'none';
+        if (data.success) {
+            setCartBadge(data.cart_count);
+        } else {
+            showNotification(data.message || 'حدث خطأ', 'error');
         }
+        batch.callbacks.forEach(callback => callback(data));
+    })
+    .catch(error => {
+        showNotification('حدث خطأ في الاتصال', 'error');
+    });
+}
+
+// Don't lose edits still waiting for the debounce when the user leaves
+window.addEventListener('pagehide', function() {
+    const batch = takeCartBatch();
+    if (batch.operations.length) {
+        navigator.sendBeacon('/cart/batch', new Blob(
+            [JSON.stringify({ operations: batch.operations })], { type: 'application/json' }));
+    }
+});
+
+// '<user id>.<cart/wishlist version>' rendered by the server; a URL carrying
+// it stays valid (and browser-cached) until the cart or wishlist changes
+function userStateUrl(path) {
+    const version = document.body.dataset.stateVersion;
+    return version ? `${path}?v=${encodeURIComponent(version)}` : path;
+}
+
+function updateCartDisplay() {
+    if (document.body.dataset.loggedIn !== 'true') return;
+    fetch(userStateUrl('/cart/count'))
+    .then(response => response.json())
+    .then(data => {
+        setCartBadge(data.count);
     })
     .catch(error => {
         console.log('خطأ في تحديث عداد السلة');
@@ -288,9 +361,16 @@ function validateForm(form) {
     return isValid;
 }
 
+// Per-user data rendered into base.html (cart count, wishlist IDs, name)
+function readPageState() {
+    const island = document.getElementById('pageState');
+    return island ? JSON.parse(island.textContent) : null;
+}
+
 // Initialize cart display on page load
 document.addEventListener('DOMContentLoaded', function() {
-    updateCartDisplay();
+    // The server already rendered the badge when it sent the page state
+    if (!readPageState()) updateCartDisplay();
     initializeSearch();
 });
 
@@ -334,7 +414,7 @@ function toggleWishlist(productId, el) {
     .then(res => res.json())
     .then(data => {
         if (data.success) {
-            icon.classList.toggle('text-danger');
+            icon.classList.toggle('text-danger', data.in_wishlist);
             showNotification(data.message, 'success');
         } else {
             showNotification(data.message || 'حدث خطأ', 'error');
@@ -363,7 +443,13 @@ document.addEventListener('DOMContentLoaded', () => {
     const loggedIn = document.body.dataset.loggedIn === 'true';
     if (!loggedIn) return;
 
-    fetch('/wishlist')
+    const state = readPageState();
+    if (state) {
+        markWishlistHearts(state.wishlist);
+        return;
+    }
+
+    fetch(userStateUrl('/wishlist'))
         .then(res => res.json())
         .then(data => {
             if (data.success && data.wishlist) {
@@ -374,19 +460,79 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 
-// Enhanced search with autocomplete simulation
+// Search-as-you-type: waits for a pause in typing, and a newer keystroke
+// aborts the request still in flight, so at most one is open per input
+const SUGGEST_DELAY = 150;
+
 function initializeEnhancedSearch() {
-    const searchInputs = document.querySelectorAll('input[name="q"]');
+    const searchInputs = document.querySelectorAll('input[name="q"], input[name="search"]');
     
     searchInputs.forEach(input => {
+        const menu = document.createElement('div');
+        menu.className = 'dropdown-menu search-suggestions';
+        input.setAttribute('autocomplete', 'off');
+        input.parentNode.classList.add('position-relative');
+        input.parentNode.appendChild(menu);
+        let timer = null;
+        let controller = null;
+
+        const hide = () => menu.classList.remove('show');
+
         input.addEventListener('input', function() {
-            // Simulate autocomplete - in real app would fetch from server
-            if (this.value.length >= 2) {
-                // Show suggestions based on current products
-                // This is a placeholder for demonstration
+            clearTimeout(timer);
+            if (controller) controller.abort();
+            const query = this.value.trim();
+            if (query.length < 2) {
+                hide();
+                return;
             }
+            timer = setTimeout(() => {
+                controller = new AbortController();
+                fetch(`/search/suggest?q=${encodeURIComponent(query)}`, {signal: controller.signal})
+                .then(response => response.json())
+                .then(data => renderSuggestions(menu, data))
+                .catch(error => {
+                    if (error.name !== 'AbortError') hide();
+                });
+            }, SUGGEST_DELAY);
+        });
+        input.addEventListener('keydown', function(e) {
+            if (e.key === 'Escape') hide();
         });
+        input.addEventListener('blur', () => setTimeout(hide, 200));
+    });
+}
+
+function renderSuggestions(menu, data) {
+    menu.replaceChildren();
+    data.categories.forEach(category => {
+        menu.appendChild(suggestionItem(
+            `/products?category=${encodeURIComponent(category)}`, category, 'fa-tags'));
+    });
+    data.products.forEach(product => {
+        menu.appendChild(suggestionItem(
+            `/search?q=${encodeURIComponent(product.name)}`, product.name, 'fa-search',
+            formatPrice(product.price)));
     });
+    menu.classList.toggle('show', menu.children.length > 0);
+}
+
+function suggestionItem(href, label, icon, detail) {
+    const item = document.createElement('a');
+    item.className = 'dropdown-item d-flex justify-content-between';
+    item.href = href;
+    const name = document.createElement('span');
+    const iconEl = document.createElement('i');
+    iconEl.className = `fas ${icon} text-muted ms-2`;
+    name.append(iconEl, label);
+    item.appendChild(name);
+    if (detail) {
+        const small = document.createElement('small');
+        small.className = 'text-muted';
+        small.textContent = detail;
+        item.appendChild(small);
+    }
+    return item;
 }
 
 // Initialize enhanced features
@@ -398,6 +544,9 @@ document.addEventListener('DOMContentLoaded', function() {
 window.addToCart = addToCart;
 window.removeFromCart = removeFromCart;
 window.showNotification = showNotification;
+window.setCartBadge = setCartBadge;
+window.queueCartOperation = queueCartOperation;
+window.flushCartBatch = flushCartBatch;
 window.quickView = quickView;
 window.toggleWishlist = toggleWishlist;
 window.scrollToTop = scrollToTop;
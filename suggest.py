@@ -0,0 +1,196 @@
+"""Search-as-you-type suggestions from an in-memory prefix index
+
+Every word position of each product name and category (normalized with
+normalize_arabic) is a key in one sorted list, so the keys starting with
+what was typed are a bisect range. Small ranges are scanned; for prefixes
+matching more than SCAN_LIMIT keys the best results were picked while
+building. A lookup therefore costs O(log n + SCAN_LIMIT) and never touches
+the database.
+
+Each worker builds its index at start-up and rebuilds it in a background
+thread when the catalog version moves (or every SUGGEST_MAX_AGE seconds,
+for the popularity order); requests keep using the old index meanwhile.
+Products are ranked by units sold (the sales rollups), then newest first.
+"""
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left
+from arabic_text import normalize_arabic, normalize_prefix
+from database import get_db_connection, catalog_cache
+from instrumentation import register_stats
+
+SUGGEST_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_CATEGORY_LIMIT = 3
+SUGGEST_MAX_AGE = float(os.environ.get('SUGGEST_MAX_AGE', 3600))
+# Longest bisect range scanned per query; larger ones are precomputed
+SCAN_LIMIT = 64
+_END = '\U0010ffff'
+
+
+class PrefixIndex:
+    """Sorted (key, rank) pairs; lookup returns the lowest ranks for a prefix"""
+
+    def __init__(self, keyed_ranks, top_n=SUGGEST_MAX_LIMIT):
+        pairs = sorted(keyed_ranks)
+        self.keys = [key for key, _ in pairs]
+        self.ranks = [rank for _, rank in pairs]
+        self.top_n = top_n
+        self.top = {}
+        self._precompute(0, len(self.keys), 0)
+
+    def _best(self, lo, hi, n):
+        return heapq.nsmallest(n, set(self.ranks[lo:hi]))
+
+    def _precompute(self, lo, hi, depth):
+        """Best ranks of keys[lo:hi], which share their first `depth` characters
+
+        Splits the range by the next character, as a trie would, and keeps
+        the result for every prefix matching too many keys to scan.
+        """
+        if hi - lo <= SCAN_LIMIT:
+            return self._best(lo, hi, self.top_n)
+        start = lo
+        while start < hi and len(self.keys[start]) <= depth:
+            start += 1  # keys equal to the prefix itself
+        candidates = self.ranks[lo:start]
+        while start < hi:
+            end = bisect_left(self.keys, self.keys[start][:depth + 1] + _END, start, hi)
+            candidates += self._precompute(start, end, depth + 1)
+            start = end
+        best = heapq.nsmallest(self.top_n, set(candidates))
+        if depth:
+            self.top[self.keys[lo][:depth]] = best
+        return best
+
+    def lookup(self, prefix, n):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + _END, lo)
+        if hi - lo > SCAN_LIMIT:
+            return self.top[prefix][:n]
+        return self._best(lo, hi, n)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def _keys(text):
+    """The normalized text from each word on: 'a b c' -> 'a b c', 'b c', 'c'"""
+    words = normalize_arabic(text).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class SuggestIndex:
+    def __init__(self, version, products, categories):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.products = products
+        self.categories = categories
+        self.product_index = PrefixIndex(
+            (key, rank) for rank, product in enumerate(products) for key in _keys(product['name']))
+        self.category_index = PrefixIndex(
+            (key, rank) for rank, category in enumerate(categories) for key in _keys(category))
+
+    def suggest(self, query, limit=SUGGEST_LIMIT, category_limit=SUGGEST_CATEGORY_LIMIT):
+        prefix = normalize_prefix(query)
+        if not prefix:
+            return {'products': [], 'categories': []}
+        return {
+            'products': [self.products[rank] for rank in self.product_index.lookup(prefix, limit)],
+            'categories': [self.categories[rank]
+                           for rank in self.category_index.lookup(prefix, category_limit)],
+        }
+
+
+def build_index():
+    """Read the catalog and sales totals into a new SuggestIndex"""
+    version = catalog_cache.check_version()
+    conn = get_db_connection()
+    products = [dict(row) for row in conn.execute('''
+        SELECT p.id, p.name, p.category, p.price
+        FROM products p
+        LEFT JOIN (SELECT product_id, SUM(units) AS units FROM sales_product_daily
+                   GROUP BY product_id) s ON s.product_id = p.id
+        ORDER BY COALESCE(s.units, 0) DESC, p.created_at DESC, p.id DESC
+    ''')]
+    categories = [row[0] for row in conn.execute('''
+        SELECT p.category FROM (SELECT DISTINCT category FROM products) p
+        LEFT JOIN (SELECT category, SUM(units) AS units FROM sales_category_daily
+                   GROUP BY category) s ON s.category = p.category
+        ORDER BY COALESCE(s.units, 0) DESC, p.category
+    ''')]
+    conn.close()
+    return SuggestIndex(version, products, categories)
+
+
+_lock = threading.Lock()
+_index = None
+_rebuilding = False
+_stats = {'builds': 0, 'build_seconds': 0.0, 'failures': 0}
+
+
+def _build():
+    global _index
+    started = time.perf_counter()
+    index = build_index()
+    with _lock:
+        _index = index
+        _stats['builds'] += 1
+        _stats['build_seconds'] = round(time.perf_counter() - started, 3)
+    return index
+
+
+def _rebuild_in_background():
+    global _rebuilding
+    try:
+        _build()
+    except Exception:
+        with _lock:
+            _stats['failures'] += 1
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def warm():
+    """Build this worker's index now (at start-up)"""
+    return _build()
+
+
+def get_index():
+    """The current index, starting a rebuild if the catalog moved on"""
+    global _rebuilding
+    index = _index
+    if index is None:
+        return _build()
+    stale = (index.version != catalog_cache.check_version()
+             or time.monotonic() - index.built_at > SUGGEST_MAX_AGE)
+    if stale:
+        with _lock:
+            if _rebuilding:
+                return index
+            _rebuilding = True
+        threading.Thread(target=_rebuild_in_background, name='suggest-index',
+                         daemon=True).start()
+    return index
+
+
+def suggest(query, limit=SUGGEST_LIMIT):
+    """{'products': [...], 'categories': [...]} for what has been typed so far"""
+    return get_index().suggest(query, limit)
+
+
+def get_stats():
+    with _lock:
+        index = _index
+        stats = dict(_stats, rebuilding=_rebuilding)
+    if index is not None:
+        stats.update(version=index.version, products=len(index.products),
+                     keys=len(index.product_index) + len(index.category_index),
+                     precomputed_prefixes=len(index.product_index.top))
+    return stats
+
+
+register_stats('search_suggest', get_stats)
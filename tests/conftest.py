@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from migrations import migrate
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, migrated database; yields a pooled connection to it"""
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'store.db'))
+    database.catalog_cache.invalidate()
+    database.user_cache.clear()
+    migrate()
+    conn = database.get_db_connection()
+    yield conn
+    conn.close()
+    database.get_pool().close_all()
+
+
+@pytest.fixture
+def make_user(db):
+    def make(username='user'):
+        cursor = db.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                            (username, f'{username}@example.com', 'x'))
+        db.commit()
+        return cursor.lastrowid
+    return make
+
+
+@pytest.fixture
+def make_product(db):
+    def make(name='منتج', stock=10, price=10.0, category='إلكترونيات'):
+        cursor = db.execute('''
+            INSERT INTO products (name, price, category, stock_quantity, in_stock)
+            VALUES (?, ?, ?, ?, 1)
+        ''', (name, price, category, stock))
+        db.commit()
+        return cursor.lastrowid
+    return make
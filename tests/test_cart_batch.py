@@ -0,0 +1,75 @@
+import pytest
+
+import database
+
+
+def _cart(db, user_id):
+    return [tuple(row) for row in db.execute(
+        'SELECT product_id, quantity FROM cart_items WHERE user_id = ? ORDER BY product_id',
+        (user_id,))]
+
+
+def test_batch_applies_operations_in_order(db, make_user, make_product):
+    user = make_user()
+    phone, watch = make_product('هاتف', price=100), make_product('ساعة', price=20)
+
+    batch = database.apply_cart_batch(user, [
+        {'op': 'add', 'product_id': phone},
+        {'op': 'add', 'product_id': phone, 'quantity': 2},
+        {'op': 'add', 'product_id': watch},
+    ])
+    assert batch['results'] == [True, True, True]
+    assert batch['summary']['total_items'] == 4
+    assert batch['summary']['total_price'] == 320
+    items = {item['product_id']: item['id'] for item in batch['summary']['items']}
+
+    batch = database.apply_cart_batch(user, [
+        {'op': 'update', 'item_id': items[phone], 'quantity': 1},
+        {'op': 'update', 'item_id': items[watch], 'quantity': 0},
+        {'op': 'remove', 'item_id': items[watch]},
+    ])
+    assert batch['results'] == [True, True, False]
+    assert _cart(db, user) == [(phone, 1)]
+
+
+def test_batch_cannot_touch_another_users_items(db, make_user, make_product):
+    owner, other = make_user('owner'), make_user('other')
+    product = make_product()
+    item_id = database.apply_cart_batch(owner, [{'op': 'add', 'product_id': product}])[
+        'summary']['items'][0]['id']
+
+    batch = database.apply_cart_batch(other, [{'op': 'remove', 'item_id': item_id}])
+    assert batch['results'] == [False]
+    assert _cart(db, owner) == [(product, 1)]
+
+
+@pytest.mark.parametrize('operations', [
+    [],
+    'add',
+    [{'op': 'add', 'product_id': 1}] * (database.MAX_CART_BATCH + 1),
+    [{'op': 'delete', 'item_id': 1}],
+    [['add', 1]],
+    [{'op': 'add', 'product_id': '1'}],
+    [{'op': 'add', 'product_id': True}],
+    [{'op': 'add', 'product_id': 1, 'quantity': 0}],
+    [{'op': 'add', 'product_id': 1, 'quantity': -2}],
+    [{'op': 'add', 'product_id': 1, 'quantity': 1.5}],
+    [{'op': 'update', 'item_id': 1}],
+    [{'op': 'remove'}],
+])
+def test_invalid_batches_are_rejected(db, make_user, make_product, operations):
+    user = make_user()
+    make_product()
+    with pytest.raises(ValueError):
+        database.apply_cart_batch(user, operations)
+
+
+def test_nothing_is_written_when_a_later_operation_is_invalid(db, make_user, make_product):
+    user = make_user()
+    product = make_product()
+    with pytest.raises(ValueError):
+        database.apply_cart_batch(user, [
+            {'op': 'add', 'product_id': product},
+            {'op': 'add', 'product_id': product, 'quantity': 0},
+        ])
+    assert _cart(db, user) == []
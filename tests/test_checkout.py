@@ -0,0 +1,79 @@
+import pytest
+
+from database import (
+    InsufficientStockError, add_to_cart, cancel_order_by_id, create_order,
+)
+
+
+def _stock(db, product_id):
+    return db.execute('SELECT stock_quantity FROM products WHERE id = ?',
+                      (product_id,)).fetchone()[0]
+
+
+def _revenue(db):
+    return db.execute('SELECT COALESCE(SUM(revenue), 0) FROM sales_daily').fetchone()[0]
+
+
+def test_checkout_takes_stock_and_records_the_sale(db, make_user, make_product):
+    user_id = make_user()
+    phone, cable = make_product('هاتف', stock=5, price=100), make_product('كابل', stock=2, price=10)
+    add_to_cart(user_id, phone, 2)
+    add_to_cart(user_id, cable, 2)
+
+    order_id = create_order(user_id)
+
+    assert _stock(db, phone) == 3
+    assert _stock(db, cable) == 0
+    assert db.execute('SELECT in_stock FROM products WHERE id = ?', (cable,)).fetchone()[0] == 0
+    assert db.execute('SELECT total_price FROM orders WHERE id = ?', (order_id,)).fetchone()[0] == 220
+    assert _revenue(db) == 220
+    assert db.execute('SELECT COUNT(*) FROM cart_items WHERE user_id = ?', (user_id,)).fetchone()[0] == 0
+
+
+def test_cancel_puts_stock_and_revenue_back(db, make_user, make_product):
+    user_id = make_user()
+    product = make_product(stock=5, price=100)
+    add_to_cart(user_id, product, 5)
+    order_id = create_order(user_id)
+
+    assert cancel_order_by_id(user_id, order_id)
+
+    assert _stock(db, product) == 5
+    assert _revenue(db) == 0
+
+
+def test_short_stock_writes_nothing(db, make_user, make_product):
+    user_id = make_user()
+    product = make_product('هاتف', stock=1)
+    add_to_cart(user_id, product, 2)
+
+    with pytest.raises(InsufficientStockError) as error:
+        create_order(user_id)
+
+    assert error.value.products == ['هاتف']
+    assert _stock(db, product) == 1
+    assert db.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('quantity', [0, -5, 1.5, '2', True])
+def test_add_to_cart_rejects_non_positive_quantities(db, make_user, make_product, quantity):
+    user_id = make_user()
+    product = make_product()
+
+    with pytest.raises(ValueError):
+        add_to_cart(user_id, product, quantity)
+
+    assert db.execute('SELECT COUNT(*) FROM cart_items').fetchone()[0] == 0
+
+
+def test_checkout_ignores_non_positive_cart_lines(db, make_user, make_product):
+    user_id = make_user()
+    product = make_product(stock=5, price=100)
+    # Written before quantities were validated
+    db.execute('INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, -5)',
+               (user_id, product))
+    db.commit()
+
+    assert create_order(user_id) is None
+    assert _stock(db, product) == 5
+    assert _revenue(db) == 0
@@ -0,0 +1,48 @@
+import sqlite3
+
+import database
+import purge_users
+
+
+def _count(db, table):
+    return db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_orphans_of_deleted_users_are_purged(db, make_user, make_product):
+    kept, gone = make_user('kept'), make_user('gone')
+    product = make_product()
+    for user_id in (kept, gone):
+        db.execute('INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, 1)',
+                   (user_id, product))
+        db.execute('INSERT INTO wishlist (user_id, product_id) VALUES (?, ?)', (user_id, product))
+    db.commit()
+
+    # What the old delete_users.py left behind: the user row alone removed
+    raw = sqlite3.connect(database.DATABASE_PATH)
+    raw.execute('DELETE FROM user_state WHERE user_id = ?', (gone,))
+    raw.execute('DELETE FROM users WHERE id = ?', (gone,))
+    raw.commit()
+    raw.close()
+
+    stats = purge_users.purge_orphans(pause=0)
+
+    assert stats['rows'] == {'cart_items': 1, 'wishlist': 1}
+    assert [row[0] for row in db.execute('SELECT user_id FROM cart_items')] == [kept]
+    assert [row[0] for row in db.execute('SELECT user_id FROM wishlist')] == [kept]
+    assert db.execute('SELECT COUNT(*) FROM user_state WHERE user_id = ?', (gone,)).fetchone()[0] == 0
+
+
+def test_purge_users_removes_everything_they_own(db, make_user, make_product):
+    user_id = make_user()
+    product = make_product()
+    db.execute('INSERT INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, 1)',
+               (user_id, product))
+    db.execute('INSERT INTO wishlist (user_id, product_id) VALUES (?, ?)', (user_id, product))
+    db.commit()
+
+    condition, params = purge_users.user_filter()
+    stats = purge_users.purge_users(condition, params, pause=0)
+
+    assert stats['rows']['users'] == 1
+    for table in ('users', 'cart_items', 'wishlist', 'user_state'):
+        assert _count(db, table) == 0
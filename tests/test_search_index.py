@@ -0,0 +1,34 @@
+import sqlite3
+
+import database
+
+
+def _found(query):
+    return [row['id'] for row in database.search_products_page(query)['items']]
+
+
+def test_products_written_by_plain_sqlite_are_searchable(db):
+    # No ar_normalize() on this connection, as in the sqlite3 CLI
+    raw = sqlite3.connect(database.DATABASE_PATH)
+    product_id = raw.execute('''
+        INSERT INTO products (name, description, price, category)
+        VALUES ('الهاتف الذكيّ', 'شاشة كبيرة', 100, 'إلكترونيات')
+    ''').lastrowid
+    raw.commit()
+
+    assert _found('هاتف') == [product_id]
+
+    raw.execute("UPDATE products SET name = 'ساعة' WHERE id = ?", (product_id,))
+    raw.commit()
+    raw.close()
+
+    assert _found('هاتف') == []
+    assert _found('الساعه') == [product_id]
+    assert db.execute('SELECT COUNT(*) FROM products_fts_pending').fetchone()[0] == 0
+
+
+def test_refresh_indexes_the_queue_in_chunks(db, make_product):
+    ids = [make_product(f'كاميرا {i}') for i in range(5)]
+
+    assert database.refresh_search_index(chunk_size=2) == 5
+    assert sorted(_found('كاميرا')) == ids
@@ -0,0 +1,40 @@
+import random
+
+import suggest
+from arabic_text import normalize_prefix
+from suggest import PrefixIndex, SuggestIndex
+
+
+def _brute_force(pairs, prefix, n):
+    return sorted({rank for key, rank in pairs if key.startswith(prefix)})[:n]
+
+
+def test_prefix_index_matches_brute_force():
+    rnd = random.Random(7)
+    # Few letters and many keys, so most prefixes go past SCAN_LIMIT
+    pairs = [(''.join(rnd.choice('ابت ') for _ in range(rnd.randint(1, 6))).strip() or 'ا', rank)
+             for rank in range(3000)]
+    index = PrefixIndex(pairs)
+    prefixes = {key[:length] for key, _ in pairs for length in range(1, len(key) + 1)}
+    assert any(len(_brute_force(pairs, p, 10 ** 6)) > suggest.SCAN_LIMIT for p in prefixes)
+    for prefix in prefixes | {'ث', 'ابتث'}:
+        for n in (1, 8, suggest.SUGGEST_MAX_LIMIT):
+            assert index.lookup(prefix, n) == _brute_force(pairs, prefix, n), prefix
+
+
+def test_normalize_prefix_strips_a_cut_short_article():
+    assert normalize_prefix('الت') == 'ت'
+    assert normalize_prefix('التلفاز') == 'تلفاز'
+    assert normalize_prefix('هاتف ال') == 'هاتف ال'
+    assert normalize_prefix('  ') == ''
+
+
+def test_suggest_matches_any_word_ranked_by_position():
+    products = [{'id': i, 'name': name} for i, name in enumerate(
+        ['شاشة التلفاز الذكية', 'تلفاز صغير', 'ساعة ذكيّة'])]
+    index = SuggestIndex(1, products, ['إلكترونيات', 'ساعات'])
+
+    assert [p['id'] for p in index.suggest('التل')['products']] == [0, 1]
+    assert [p['id'] for p in index.suggest('ذكي')['products']] == [0, 2]
+    assert index.suggest('سا')['categories'] == ['ساعات']
+    assert index.suggest('') == {'products': [], 'categories': []}
@@ -0,0 +1,78 @@
+import os
+from cache import TTLCache
+from database import (
+    get_db_connection, run_write_transaction, _keyset_page, clamp_page_size, PAGE_SIZE
+)
+from instrumentation import register_stats
+
+# Per-worker wishlist ID sets, keyed by user and tagged with the user's
+# state version (see migrations.py), so a stale set is never returned
+WISHLIST_CACHE_SIZE = int(os.environ.get('WISHLIST_CACHE_SIZE', 1024))
+WISHLIST_CACHE_TTL = float(os.environ.get('WISHLIST_CACHE_TTL', 300))
+
+id_cache = TTLCache(WISHLIST_CACHE_SIZE, WISHLIST_CACHE_TTL)
+register_stats('wishlist_cache', id_cache.stats)
+
+
+def toggle(user_id, product_id):
+    """Add or remove a product atomically; returns the new state
+
+    True if the product is now in the wishlist, False if it was removed,
+    None if no such product exists. Runs under the write lock, so two
+    concurrent toggles can't both see "absent" and both insert.
+    """
+    def work(conn):
+        deleted = conn.execute('DELETE FROM wishlist WHERE user_id = ? AND product_id = ?',
+                               (user_id, product_id)).rowcount
+        if deleted:
+            return False
+        inserted = conn.execute('''
+            INSERT INTO wishlist (user_id, product_id)
+            SELECT ?, id FROM products WHERE id = ?
+        ''', (user_id, product_id)).rowcount
+        return True if inserted else None
+
+    state = run_write_transaction(work)
+    id_cache.delete(int(user_id))
+    return state
+
+
+def get_wishlist_for_user(user_id):
+    """ترجع قائمة product_id للمستخدم"""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT product_id FROM wishlist WHERE user_id=?', (user_id,)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def product_ids(user_id, version):
+    """The user's wishlist as a frozenset, cached per state version
+
+    `version` is the user's current state version (get_user_state_version
+    or the page state); any wishlist change moves it, so a cached set for
+    the same version is always current.
+    """
+    user_id = int(user_id)
+    entry = id_cache.get(user_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    ids = frozenset(get_wishlist_for_user(user_id))
+    id_cache.set(user_id, (version, ids))
+    return ids
+
+
+def get_wishlist_page(user_id, cursor=None, limit=PAGE_SIZE):
+    """One page of wishlisted products, most recently added first
+
+    A single wishlist JOIN products query (keyset-paginated on
+    added_at), so the page size and not the wishlist size bounds it.
+    """
+    limit = clamp_page_size(limit)
+    conn = get_db_connection()
+    page = _keyset_page(
+        conn,
+        'SELECT p.*, w.added_at AS sort_key FROM wishlist w JOIN products p ON p.id = w.product_id',
+        ['w.user_id = ?'], [user_id], 'w.added_at', True, cursor, limit,
+        id_expr='w.product_id')
+    conn.close()
+    return page